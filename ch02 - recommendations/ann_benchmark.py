@@ -0,0 +1,95 @@
+""" Recall vs latency of LSHIndex on MovieLens
+
+    python ann_benchmark.py [--sample 100] [--count 5]
+
+    Exact top matches come from the similarity matrix; a match returned by the index
+    is a hit if it is at least as similar as the count-th exact one (ties count)
+"""
+import argparse
+import logging
+import random
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ann_index import LSHIndex
+from data import movielens
+from prefs_matrix import PrefsMatrix
+from recommendations import eval_top_matches, get_similarity_matrix
+
+log = logging.getLogger(__name__)
+
+# (n_tables, n_planes, probes)
+CONFIGS = [
+    (4, 8, 0),
+    (8, 8, 0),
+    (8, 6, 0),
+    (8, 6, 2),
+    (16, 6, 2),
+    (16, 4, 2),
+]
+
+
+def load_prefs() -> PrefsMatrix:
+    movielens.download()
+    ratings = movielens.load_columns("ratings.csv")
+    return PrefsMatrix.from_arrays(
+        ratings["userId"], ratings["movieId"], ratings["rating"]
+    )
+
+
+def run(
+    prefs: PrefsMatrix, users: List, count: int, thresholds: Dict, index=None
+) -> Tuple[float, float]:
+    """ Returns (recall, mean latency in ms) """
+    hits = 0
+    elapsed = 0.0
+    for user in users:
+        start = time.perf_counter()
+        matches = eval_top_matches(user, count=count, prefs=prefs, index=index)
+        elapsed += time.perf_counter() - start
+        hits += sum(1 for sim, _ in matches if sim >= thresholds[user] - 1e-9)
+
+    return hits / (count * len(users)), 1000 * elapsed / len(users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample", type=int, default=100, help="users queried")
+    parser.add_argument("--count", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prefs = load_prefs()
+    log.info("Loaded %s", prefs)
+
+    keys, matrix = get_similarity_matrix(prefs)
+    np.fill_diagonal(matrix, -np.inf)
+    kth = np.sort(matrix, axis=1)[:, -args.count]
+    thresholds = dict(zip(keys, kth.tolist()))
+
+    users = random.Random(args.seed).sample(keys, min(args.sample, len(keys)))
+
+    print(
+        f"{'tables':>6} {'planes':>6} {'probes':>6} {'build s':>8} {'recall':>6} {'ms':>8}"
+    )
+    recall, latency = run(prefs, users, args.count, thresholds)
+    print(f"{'exhaustive':>20} {'':>8} {recall:6.3f} {latency:8.2f}")
+
+    for n_tables, n_planes, probes in CONFIGS:
+        start = time.perf_counter()
+        index = LSHIndex(
+            prefs, n_tables=n_tables, n_planes=n_planes, probes=probes, seed=args.seed
+        )
+        build = time.perf_counter() - start
+
+        recall, latency = run(prefs, users, args.count, thresholds, index)
+        print(
+            f"{n_tables:6d} {n_planes:6d} {probes:6d} {build:8.2f} {recall:6.3f} {latency:8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,113 @@
+""" Approximate nearest neighbours for eval_top_matches
+
+    Pearson similarity is close to the cosine of mean-centred rating vectors. Random
+    hyperplanes hash such vectors so that the probability of two of them sharing a
+    bit grows with their cosine (random-hyperplane LSH). LSHIndex hashes every key
+    into n_tables tables of n_planes bits and only the keys that share a bucket
+    with the query (or with one of its `probes` closest buckets) are scored:
+
+        eval_top_matches(user, prefs=prefs, index=LSHIndex(prefs))
+
+    Recall grows with n_tables and probes and drops with n_planes, latency the
+    other way around (see ann_benchmark.py)
+"""
+import logging
+from typing import Dict, Hashable, List, Mapping, Optional, Set
+
+import numpy as np
+
+from similarity_engine import rating_matrix
+
+log = logging.getLogger(__name__)
+
+
+class LSHIndex:
+    def __init__(
+        self,
+        prefs: Dict[str, Dict],
+        *,
+        n_tables: int = 8,
+        n_planes: int = 6,
+        probes: int = 2,
+        seed: Optional[int] = None,
+    ):
+        assert 0 < n_planes < 63
+        self.n_tables = n_tables
+        self.n_planes = n_planes
+        self.probes = probes
+
+        self.keys, items, values, mask = rating_matrix(prefs)
+        self.key_ids: Dict[str, int] = {key: i for i, key in enumerate(self.keys)}
+        self.item_ids: Dict[Hashable, int] = {item: j for j, item in enumerate(items)}
+
+        rng = np.random.default_rng(seed)
+        # (tables x planes x items)
+        self.planes = rng.standard_normal((n_tables, n_planes, len(items)))
+        self._weights = np.left_shift(1, np.arange(n_planes, dtype=np.int64))
+
+        # (tables x keys x planes)
+        self.projections = np.einsum(
+            "tpj,ij->tip", self.planes, _centred(values, mask)
+        ).astype(np.float32)
+        self.codes = (self.projections > 0).astype(np.int64) @ self._weights
+
+        # per table: code -> ids of the keys in that bucket
+        self.buckets: List[Dict[int, np.array]] = []
+        for codes in self.codes:
+            order = np.argsort(codes, kind="stable")
+            unique, starts = np.unique(codes[order], return_index=True)
+            self.buckets.append(dict(zip(unique.tolist(), np.split(order, starts[1:]))))
+
+        log.debug(
+            "%d keys hashed in %d tables, %3.1f keys per bucket",
+            len(self.keys),
+            n_tables,
+            np.mean([len(b) for table in self.buckets for b in table.values()]),
+        )
+
+    def __contains__(self, key) -> bool:
+        return key in self.key_ids
+
+    def _project(self, ratings: Mapping[Hashable, float]) -> np.array:
+        values = np.zeros(len(self.item_ids))
+        mask = np.zeros(len(self.item_ids))
+        for item, score in ratings.items():
+            j = self.item_ids.get(item)
+            if j is not None:
+                values[j], mask[j] = score, 1.0
+
+        return self.planes @ _centred(values[np.newaxis], mask[np.newaxis])[0]
+
+    def candidates(
+        self, user: str, *, ratings: Optional[Mapping[Hashable, float]] = None
+    ) -> Set[str]:
+        """ Keys sharing a bucket with user in any table
+
+            Users that were not indexed are hashed on the fly from their ratings
+        """
+        if ratings is None:
+            projections = self.projections[:, self.key_ids[user]]
+        else:
+            projections = self._project(ratings)
+
+        found: Set[str] = set()
+        for table, proj in zip(self.buckets, projections):
+            code = int((proj > 0).astype(np.int64) @ self._weights)
+            probed = [code]
+            # multi-probe: also visits the buckets across the least confident planes
+            for bit in np.argsort(np.abs(proj))[: self.probes].tolist():
+                probed.append(code ^ (1 << bit))
+
+            for c in probed:
+                found.update(self.keys[i] for i in table.get(c, ()))
+
+        found.discard(user)
+        return found
+
+
+def _centred(values: np.array, mask: np.array) -> np.array:
+    """ Subtracts from every row the mean of its rated entries """
+    counts = mask.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(counts > 0, values.sum(axis=1, keepdims=True) / counts, 0.0)
+    return (values - means) * mask
@@ -1,11 +1,15 @@
+import json
 import logging
+import os
 import shutil
 import sys
 import tempfile
 import urllib.request
 import zipfile
 from pathlib import Path
+from typing import Dict
 
+import numpy as np
 import pandas as pd
 
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +19,10 @@ URL_LATEST_SMALL = "http://files.grouplens.org/datasets/movielens/ml-latest-smal
 
 current_dir = Path(sys.argv[0] if __name__ == "__main__" else __file__).resolve().parent
 local_dir = current_dir / "ml-latest-small"
+cache_dir = local_dir / "cache"
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
 
 
 def download(*, force: bool = False):
@@ -37,5 +45,105 @@ def load(filename: str) -> pd.DataFrame:
     return pd.read_csv(local_dir / filename)
 
 
+def _compact(column: pd.Series) -> np.array:
+    """ Casts to the smallest dtype holding the column exactly, e.g. int32 ids """
+    values = column.values
+    if np.issubdtype(values.dtype, np.integer):
+        for dtype in (np.int32, np.int64):
+            info = np.iinfo(dtype)
+            if values.size == 0 or info.min <= values.min() <= values.max() <= info.max:
+                return values.astype(dtype)
+
+    if np.issubdtype(values.dtype, np.floating):
+        for dtype in (np.float16, np.float32):
+            compact = values.astype(dtype)
+            if np.array_equal(compact, values, equal_nan=True):
+                return compact
+        return values
+
+    raise ValueError(f"Column {column.name} of dtype {values.dtype} is not numeric")
+
+
+def _source_stamp(source: Path) -> Dict:
+    stat = source.stat()
+    return {"source": source.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def convert(filename: str) -> Path:
+    """ Converts a numeric csv (e.g. ratings.csv) into one .npy file per column
+
+        The files are written in a temporary sibling folder and moved into place
+        with os.replace: processes that memory-mapped the previous files keep
+        reading them unchanged. The manifest is moved last, so a folder with a
+        manifest is complete
+    """
+    source = local_dir / filename
+    target = cache_dir / source.stem
+    target.mkdir(parents=True, exist_ok=True)
+
+    log.info("converting %s into %s ...", source, target)
+    df = pd.read_csv(source)
+
+    staging = Path(tempfile.mkdtemp(prefix=f".{source.stem}-", dir=cache_dir))
+    try:
+        columns = {}
+        for name in df.columns:
+            values = _compact(df[name])
+            np.save(staging / f"{name}.npy", values)
+            columns[name] = {"file": f"{name}.npy", "dtype": values.dtype.str}
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            **_source_stamp(source),
+            "rows": len(df),
+            "columns": columns,
+        }
+        with open(staging / MANIFEST_NAME, "wt") as fh:
+            json.dump(manifest, fh, indent=1)
+
+        # no manifest while old and new columns are mixed
+        if (target / MANIFEST_NAME).exists():
+            os.remove(target / MANIFEST_NAME)
+        for column in columns.values():
+            os.replace(staging / column["file"], target / column["file"])
+        os.replace(staging / MANIFEST_NAME, target / MANIFEST_NAME)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return target
+
+
+def load_columns(filename: str, *, mmap_mode: str = "r") -> Dict[str, np.array]:
+    """ Memory-mapped columns of a numeric csv, e.g. load_columns("ratings.csv")
+
+        The binary cache is (re)built the first time or when the csv changes.
+        Afterwards loading just maps the files, so it takes milliseconds and
+        the pages are shared by all processes that load them
+    """
+    source = local_dir / filename
+    target = cache_dir / source.stem
+
+    try:
+        with open(target / MANIFEST_NAME, "rt") as fh:
+            manifest = json.load(fh)
+    except FileNotFoundError:
+        manifest = {}
+
+    stamp = _source_stamp(source) if source.exists() else {}
+    outdated = manifest.get("version") != MANIFEST_VERSION or any(
+        manifest.get(key) != value for key, value in stamp.items()
+    )
+    if outdated:
+        target = convert(filename)
+        with open(target / MANIFEST_NAME, "rt") as fh:
+            manifest = json.load(fh)
+
+    return {
+        name: np.load(target / column["file"], mmap_mode=mmap_mode)
+        for name, column in manifest["columns"].items()
+    }
+
+
 if __name__ == "__main__":
     download()
+    convert("ratings.csv")
@@ -0,0 +1,204 @@
+""" Latent factor recommendations (matrix factorization)
+
+    Every key (user) u and item i gets a vector of `factors` float32 weights,
+    and a score is predicted as
+
+        mean + U[u] . V[i]
+
+    The factors are fitted with alternating least squares (ALS): with V fixed, each
+    row of U is a small ridge regression over the items that user scored, and the
+    other way around. Rows are solved in blocks on a thread pool (numpy releases
+    the GIL) and training stops early once the RMSE on a holdout of the scores
+    stops improving.
+
+    Scoring a user against all items is then a single mat-vec product, V @ U[u]
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prefs_matrix import PrefsMatrix
+
+log = logging.getLogger(__name__)
+
+DTYPE = np.float32
+
+
+def _solve_rows(
+    fixed: np.array,
+    indptr: np.array,
+    indices: np.array,
+    residuals: np.array,
+    rows: range,
+    reg: float,
+) -> np.array:
+    """ Ridge solutions of rows given the fixed factors of the other side """
+    factors = fixed.shape[1]
+    gram = np.empty((len(rows), factors, factors), dtype=DTYPE)
+    rhs = np.zeros((len(rows), factors), dtype=DTYPE)
+
+    for n, row in enumerate(rows):
+        start, stop = indptr[row], indptr[row + 1]
+        sub = fixed[indices[start:stop]]
+        gram[n] = sub.T @ sub
+        rhs[n] = sub.T @ residuals[start:stop]
+        # regularization scaled by the number of scores (weighted-lambda ALS)
+        gram[n].flat[:: factors + 1] += reg * max(stop - start, 1)
+
+    return np.linalg.solve(gram, rhs[..., np.newaxis])[..., 0]
+
+
+def _half_step(pool, target, fixed, csr, *, reg, block_size):
+    """ Solves in place every row of target with the other side fixed """
+    indptr, indices, residuals = csr
+    blocks = [
+        range(start, min(start + block_size, target.shape[0]))
+        for start in range(0, target.shape[0], block_size)
+    ]
+    solutions = pool.map(
+        lambda rows: _solve_rows(fixed, indptr, indices, residuals, rows, reg), blocks
+    )
+    for rows, solved in zip(blocks, solutions):
+        target[rows.start : rows.stop] = solved
+
+
+class FactorModel:
+    def __init__(
+        self,
+        keys: List,
+        items: List,
+        user_factors: np.array,
+        item_factors: np.array,
+        mean: float,
+        prefs: PrefsMatrix,
+    ):
+        self.keys = keys
+        self.items = items
+        self.key_ids: Dict = {key: i for i, key in enumerate(keys)}
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.mean = mean
+        self.prefs = prefs
+        self.history: List[Tuple[float, float]] = []  # (train, holdout) RMSE
+
+    @classmethod
+    def train(
+        cls,
+        prefs: Dict[str, Dict],
+        *,
+        factors: int = 32,
+        reg: float = 0.05,
+        iterations: int = 30,
+        holdout: float = 0.1,
+        patience: int = 2,
+        workers: Optional[int] = None,
+        block_size: int = 256,
+        seed: Optional[int] = None,
+    ) -> "FactorModel":
+        """ Fits the factors of prefs with ALS
+
+            A random `holdout` fraction of the scores is left out to measure RMSE
+            and training stops after `patience` iterations without improving it
+            (the best factors are kept). Rows are solved block_size at a time on
+            `workers` threads
+        """
+        if not isinstance(prefs, PrefsMatrix):
+            prefs = PrefsMatrix.from_dict(prefs)
+
+        rng = np.random.default_rng(seed)
+        rows, cols = prefs.row_ids(), prefs.indices
+        scores = prefs.data.astype(DTYPE)
+
+        test = rng.random(scores.size) < holdout
+        train = PrefsMatrix.from_coo(
+            prefs.key_names, prefs.item_names, rows[~test], cols[~test], scores[~test]
+        )
+        mean = float(train.data.mean()) if train.nnz else 0.0
+
+        n_keys, n_items = prefs.shape
+        scale = 1.0 / np.sqrt(factors)
+        user_factors = (rng.standard_normal((n_keys, factors)) * scale).astype(DTYPE)
+        item_factors = (rng.standard_normal((n_items, factors)) * scale).astype(DTYPE)
+
+        model = cls(
+            prefs.key_names, prefs.item_names, user_factors, item_factors, mean, prefs,
+        )
+
+        train_rows = train.row_ids()
+        by_user = (train.indptr, train.indices, train.data - mean)
+        by_item = (train.T.indptr, train.T.indices, train.T.data - mean)
+
+        best = (np.inf, user_factors.copy(), item_factors.copy())
+        stale = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            step = partial(_half_step, pool, reg=reg, block_size=block_size)
+            for iteration in range(iterations):
+                step(model.user_factors, model.item_factors, by_user)
+                step(model.item_factors, model.user_factors, by_item)
+
+                train_rmse = model.rmse(train_rows, train.indices, train.data)
+                test_rmse = model.rmse(rows[test], cols[test], scores[test])
+                model.history.append((train_rmse, test_rmse))
+                log.info(
+                    "iteration %d: train RMSE %5.4f, holdout RMSE %5.4f",
+                    iteration,
+                    train_rmse,
+                    test_rmse,
+                )
+
+                if test_rmse < best[0]:
+                    best = (
+                        test_rmse,
+                        model.user_factors.copy(),
+                        model.item_factors.copy(),
+                    )
+                    stale = 0
+                elif test.any():
+                    stale += 1
+                    if stale >= patience:
+                        log.info("stopping early, holdout RMSE %5.4f", best[0])
+                        break
+
+        if test.any():
+            _, model.user_factors, model.item_factors = best
+        return model
+
+    def predict(self, rows: np.array, cols: np.array) -> np.array:
+        return self.mean + np.einsum(
+            "ij,ij->i", self.user_factors[rows], self.item_factors[cols]
+        )
+
+    def rmse(self, rows: np.array, cols: np.array, scores: np.array) -> float:
+        if not len(scores):
+            return np.nan
+        return float(np.sqrt(np.mean((self.predict(rows, cols) - scores) ** 2)))
+
+    def score_items(self, user) -> np.array:
+        """ Predicted score of user for every item: one mat-vec product """
+        return self.mean + self.item_factors @ self.user_factors[self.key_ids[user]]
+
+    def get_recommendations(
+        self, user: str, *, count: int = 5, prefs: Optional[Dict[str, Dict]] = None
+    ) -> List[Tuple[float, str]]:
+        """ Same contract as recommendations.get_recommendations
+
+            Items scored by user in prefs (the training prefs by default) are skipped
+        """
+        prefs = self.prefs if prefs is None else prefs
+        if user not in self.key_ids:
+            return []
+
+        scores = self.score_items(user)
+        item_ids = self.prefs.item_ids
+        scored = [item_ids[item] for item in prefs.get(user, {}) if item in item_ids]
+        scores[scored] = -np.inf
+
+        count = min(count, scores.size - len(scored))
+        if count <= 0:
+            return []
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(float(scores[j]), self.items[j]) for j in best]
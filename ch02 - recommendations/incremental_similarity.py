@@ -0,0 +1,108 @@
+""" Pearson similarities kept up to date while ratings stream in
+
+    similarity_pearson only needs, over the items co-rated by two users, the
+    sufficient statistics n, Σx, Σy, Σx², Σy² and Σxy. PearsonIndex keeps them for
+    every pair of users with at least one co-rated item:
+
+     - add_rating(user, item, score) updates the pairs of user with the other raters
+       of item, i.e. costs O(# raters of item)
+     - similarity(user1, user2) is O(1) and has the signature of the similarity
+       functions in recommendations.py, so e.g.
+
+        get_recommendations(user, similarity=index.similarity, prefs=index.prefs)
+
+    Memory grows with the number of pairs of users that share at least one item
+"""
+import logging
+from math import sqrt
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from recommendations import similarity_pearson
+
+log = logging.getLogger(__name__)
+
+# positions in the statistics of a pair
+N, SX, SY, SXX, SYY, SXY = range(6)
+
+
+class PearsonIndex:
+    def __init__(self, prefs: Optional[Dict[str, Dict]] = None):
+        # user -> {item -> score}
+        self.prefs: Dict[str, Dict[Hashable, float]] = {}
+        # item -> {user -> score}
+        self._raters: Dict[Hashable, Dict[str, float]] = {}
+        # (user1, user2) with user1 < user2 -> [n, Σx, Σy, Σx², Σy², Σxy]
+        self._stats: Dict[Tuple[str, str], List[float]] = {}
+
+        for user, ratings in (prefs or {}).items():
+            for item, score in ratings.items():
+                self.add_rating(user, item, score)
+
+    def __len__(self) -> int:
+        """ number of pairs of users with co-rated items """
+        return len(self._stats)
+
+    def _update(self, user: str, x: float, other: str, y: float, sign: int):
+        if other < user:
+            user, x, other, y = other, y, user, x
+
+        key = (user, other)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+
+        stats[N] += sign
+        stats[SX] += sign * x
+        stats[SY] += sign * y
+        stats[SXX] += sign * x * x
+        stats[SYY] += sign * y * y
+        stats[SXY] += sign * x * y
+
+        if stats[N] == 0:
+            del self._stats[key]
+
+    def _account(self, user: str, item: Hashable, score: float, sign: int):
+        for other, other_score in self._raters.get(item, {}).items():
+            if other != user:
+                self._update(user, score, other, other_score, sign)
+
+    def add_rating(self, user: str, item: Hashable, score: float):
+        """ Adds or replaces the score of user on item """
+        ratings = self.prefs.setdefault(user, {})
+        if item in ratings:
+            self._account(user, item, ratings[item], -1)
+
+        self._account(user, item, score, +1)
+        ratings[item] = score
+        self._raters.setdefault(item, {})[user] = score
+
+    def remove_rating(self, user: str, item: Hashable):
+        score = self.prefs[user].pop(item)
+        del self._raters[item][user]
+        self._account(user, item, score, -1)
+
+    def similarity(
+        self, user1: str, user2: str, *, prefs: Optional[Dict[str, Dict]] = None
+    ) -> float:
+        """ Same as similarity_pearson(user1, user2, prefs=self.prefs)
+
+            prefs is only accepted for compatibility and ignored
+        """
+        # pylint: disable=unused-argument
+        if user1 == user2:
+            return similarity_pearson(user1, user2, prefs=self.prefs)
+
+        stats = self._stats.get((user1, user2) if user1 < user2 else (user2, user1))
+        if stats is None or stats[N] <= 1:
+            return 0
+
+        n = stats[N]
+        # how much variables change together
+        cross = stats[SXY] - stats[SX] * stats[SY] / n
+        # product of individual variations
+        var_x = stats[SXX] - stats[SX] * stats[SX] / n
+        var_y = stats[SYY] - stats[SY] * stats[SY] / n
+        if var_x <= 0 or var_y <= 0:
+            return 0
+
+        return cross / sqrt(var_x * var_y)
@@ -0,0 +1,189 @@
+""" Item-based recommendations
+
+    Similarities between items change far less often than between users, so the
+    k most similar items of every item are computed offline on flip_mapping(prefs)
+    and persisted as .npy tables which are memory-mapped at load time.
+
+    A recommendation then costs (# items scored by the user) x k lookups, no matter
+    how many users there are
+"""
+import json
+import logging
+from collections import defaultdict
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+from recommendations import (
+    SCORE_INDEX,
+    VECTORIZED_METRICS,
+    flip_mapping,
+    similarity_pearson,
+)
+from similarity_engine import DEFAULT_CHUNK_SIZE, rating_matrix, similarity_block
+
+log = logging.getLogger(__name__)
+
+NEIGHBOURS_FILE = "neighbours.npy"
+SIMILARITIES_FILE = "similarities.npy"
+ITEMS_FILE = "items.json"
+
+MISSING = -1  # padding of neighbours when there are less than k other items
+
+
+class ItemNeighbours:
+    """ Top-k table: row i lists the ids of the items most similar to items[i] """
+
+    def __init__(
+        self, items: Sequence[Hashable], neighbours: np.array, similarities: np.array
+    ):
+        assert (
+            neighbours.shape == similarities.shape == (len(items), neighbours.shape[1])
+        )
+
+        self.items: List[Hashable] = list(items)
+        self.item_ids: Dict[Hashable, int] = {item: i for i, item in enumerate(items)}
+        self.neighbours = neighbours  # int32 ids, MISSING padded
+        self.similarities = similarities  # float32, descending per row
+
+    @property
+    def k(self) -> int:
+        return self.neighbours.shape[1]
+
+    @classmethod
+    def build(
+        cls,
+        prefs: Dict[str, Dict],
+        *,
+        k: int = 20,
+        similarity=similarity_pearson,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> "ItemNeighbours":
+        """ Offline step: top-k similar items of every item scored in prefs """
+        item_prefs = flip_mapping(prefs)
+
+        metric = VECTORIZED_METRICS.get(similarity)
+        if metric is None:
+            items = sorted(item_prefs.keys())
+            values = mask = None
+        else:
+            items, _, values, mask = rating_matrix(item_prefs)
+
+        size = len(items)
+        k = min(k, max(size - 1, 0))
+        neighbours = np.full((size, k), MISSING, dtype=np.int32)
+        similarities = np.zeros((size, k), dtype=np.float32)
+
+        for start in range(0, size, chunk_size):
+            rows = slice(start, min(start + chunk_size, size))
+            if metric is None:
+                block = np.array(
+                    [
+                        [similarity(p1, p2, prefs=item_prefs) for p2 in items]
+                        for p1 in items[rows]
+                    ],
+                    dtype=float,
+                ).reshape(rows.stop - rows.start, size)
+            else:
+                block = similarity_block(values, mask, rows, slice(None), metric=metric)
+
+            # an item is not its own neighbour
+            block[np.arange(block.shape[0]), np.arange(rows.start, rows.stop)] = -np.inf
+
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_sims, axis=1, kind="stable")
+
+            neighbours[rows] = np.take_along_axis(top, order, axis=1)
+            similarities[rows] = np.take_along_axis(top_sims, order, axis=1)
+            log.debug(
+                "neighbours of items %d-%d of %d done", rows.start, rows.stop, size
+            )
+
+        return cls(items, neighbours, similarities)
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / NEIGHBOURS_FILE, self.neighbours)
+        np.save(path / SIMILARITIES_FILE, self.similarities)
+        with open(path / ITEMS_FILE, "wt") as fh:
+            json.dump(self.items, fh)
+
+    @classmethod
+    def load(cls, path: Path, *, mmap_mode: str = "r") -> "ItemNeighbours":
+        """ Memory-maps the tables saved in path (use mmap_mode=None to read them) """
+        path = Path(path)
+        with open(path / ITEMS_FILE, "rt") as fh:
+            items = json.load(fh)
+        return cls(
+            items,
+            np.load(path / NEIGHBOURS_FILE, mmap_mode=mmap_mode),
+            np.load(path / SIMILARITIES_FILE, mmap_mode=mmap_mode),
+        )
+
+    def most_similar(self, item: Hashable) -> List[Tuple[float, Hashable]]:
+        i = self.item_ids[item]
+        return [
+            (float(sim), self.items[j])
+            for j, sim in zip(
+                self.neighbours[i].tolist(), self.similarities[i].tolist()
+            )
+            if j != MISSING
+        ]
+
+
+def get_item_recommendations(
+    user: str, *, count: int = 5, neighbours: ItemNeighbours, prefs: Dict[str, Dict]
+) -> List[Tuple[float, str]]:
+    """ Returns a list of recommendations of items the user has not scored
+
+        Each unscored item is rated by the similarity-weighted average of the user's
+        scores on the items it is a neighbour of
+    """
+
+    def _nill():
+        return 0
+
+    rating = defaultdict(_nill)
+    totals = defaultdict(_nill)
+
+    user_rating = prefs.get(user, {})
+
+    for item, score in user_rating.items():
+        if item not in neighbours.item_ids:
+            continue
+        for sim, other in neighbours.most_similar(item):
+            if sim > 0 and other not in user_rating:
+                rating[other] += sim * score
+                totals[other] += sim
+
+    # normalize and encapsulate
+    scores = [(rating[name] / totals[name], name) for name in rating]
+
+    scores.sort(key=itemgetter(SCORE_INDEX), reverse=True)
+
+    return scores[:count]
+
+
+def main():
+    # pylint: disable=import-outside-toplevel
+    from data import movielens
+    from prefs_matrix import PrefsMatrix
+
+    movielens.download()
+    ratings = movielens.load_columns("ratings.csv")
+    prefs = PrefsMatrix.from_arrays(
+        ratings["userId"], ratings["movieId"], ratings["rating"]
+    )
+
+    log.info("Building item neighbours for %s", prefs)
+    table = ItemNeighbours.build(prefs)
+    table.save(movielens.local_dir / "item-neighbours")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
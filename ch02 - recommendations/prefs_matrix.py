@@ -0,0 +1,280 @@
+""" Compact interned preferences
+
+    PrefsMatrix interns keys (e.g. critics) and items (e.g. movies) to integer ids
+    and keeps the scores in CSR arrays: the items scored by key i are
+    indices[indptr[i]:indptr[i+1]] with scores data[indptr[i]:indptr[i+1]]
+
+    It is a read-only Mapping[key, Mapping[item, score]] and can be passed as
+    prefs to every function in recommendations.py
+"""
+from collections.abc import ItemsView, Mapping, ValuesView
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+INDEX_DTYPE = np.int32
+SCORE_DTYPE = np.float32
+
+
+class PrefsRow(Mapping):
+    """ Read-only item -> score view over the slice of a row """
+
+    __slots__ = ("_matrix", "_start", "_stop")
+
+    def __init__(self, matrix: "PrefsMatrix", start: int, stop: int):
+        self._matrix = matrix
+        self._start = start
+        self._stop = stop
+
+    def _indices(self) -> np.array:
+        return self._matrix.indices[self._start : self._stop]
+
+    def _scores(self) -> np.array:
+        return self._matrix.data[self._start : self._stop]
+
+    def __getitem__(self, item: Hashable) -> float:
+        col = self._matrix.item_ids.get(item)
+        if col is None:
+            raise KeyError(item)
+        indices = self._indices()
+        pos = int(np.searchsorted(indices, col))
+        if pos == indices.size or indices[pos] != col:
+            raise KeyError(item)
+        return float(self._matrix.data[self._start + pos])
+
+    def __iter__(self) -> Iterator[Hashable]:
+        names = self._matrix.item_names
+        return (names[j] for j in self._indices().tolist())
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def items(self) -> ItemsView:
+        return _RowItems(self)
+
+    def values(self) -> ValuesView:
+        return _RowValues(self)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({dict(self.items())})"
+
+
+class _RowItems(ItemsView):
+    def __iter__(self):
+        return zip(iter(self._mapping), self._mapping._scores().tolist())
+
+
+class _RowValues(ValuesView):
+    def __iter__(self):
+        return iter(self._mapping._scores().tolist())
+
+
+class PrefsMatrix(Mapping):
+    """ key -> {item -> score} stored as interned CSR arrays
+
+        The item-major (CSC) arrays are allocated on first access to T, a copy of
+        all the scores sorted by item, and cached afterwards: T.T is self and later
+        accesses to T do not copy anything
+    """
+
+    def __init__(
+        self,
+        key_names: Sequence[Hashable],
+        item_names: Sequence[Hashable],
+        indptr: np.array,
+        indices: np.array,
+        data: np.array,
+        *,
+        row_ids: Optional[np.array] = None,
+    ):
+        assert len(indptr) == len(key_names) + 1
+        assert len(indices) == len(data) == indptr[-1]
+
+        self.key_names: List[Hashable] = list(key_names)
+        self.item_names: List[Hashable] = list(item_names)
+        self.key_ids: Dict[Hashable, int] = {k: i for i, k in enumerate(key_names)}
+        self.item_ids: Dict[Hashable, int] = {k: i for i, k in enumerate(item_names)}
+
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+        self._row_ids = row_ids
+        self._transposed: Optional[PrefsMatrix] = None
+
+    @classmethod
+    def from_arrays(
+        cls,
+        keys: Sequence[Hashable],
+        items: Sequence[Hashable],
+        scores: Sequence[float],
+    ) -> "PrefsMatrix":
+        """ Builds from three parallel columns, e.g. userId, movieId, rating
+
+            When a (key, item) pair is repeated, its last score wins
+        """
+        key_names, rows = np.unique(np.asarray(keys), return_inverse=True)
+        item_names, cols = np.unique(np.asarray(items), return_inverse=True)
+        return cls.from_coo(
+            key_names.tolist(), item_names.tolist(), rows, cols, np.asarray(scores)
+        )
+
+    @classmethod
+    def from_dict(cls, prefs: Dict[Hashable, Dict[Hashable, float]]) -> "PrefsMatrix":
+        key_names = list(prefs.keys())
+        item_ids: Dict[Hashable, int] = {}
+
+        rows, cols, scores = [], [], []
+        for i, key in enumerate(key_names):
+            for item, score in prefs[key].items():
+                rows.append(i)
+                cols.append(item_ids.setdefault(item, len(item_ids)))
+                scores.append(score)
+
+        return cls.from_coo(
+            key_names,
+            list(item_ids.keys()),
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            np.array(scores),
+        )
+
+    @classmethod
+    def from_coo(cls, key_names, item_names, rows, cols, scores) -> "PrefsMatrix":
+        """ Builds from the row and column ids of every score
+
+            Duplicated (row, column) pairs are merged, keeping the last score
+        """
+        rows, cols, scores = np.asarray(rows), np.asarray(cols), np.asarray(scores)
+        # stable: the duplicates of a pair stay in input order, the last one is kept
+        order = np.lexsort((cols, rows))
+        last = np.ones(order.size, dtype=bool)
+        last[:-1] = (rows[order[1:]] != rows[order[:-1]]) | (
+            cols[order[1:]] != cols[order[:-1]]
+        )
+        order = order[last]
+
+        indptr = np.zeros(len(key_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[order], minlength=len(key_names)), out=indptr[1:])
+        return cls(
+            key_names,
+            item_names,
+            indptr,
+            cols[order].astype(INDEX_DTYPE),
+            scores[order].astype(SCORE_DTYPE),
+        )
+
+    # Mapping protocol ---
+
+    def __getitem__(self, key: Hashable) -> PrefsRow:
+        i = self.key_ids[key]
+        return PrefsRow(self, int(self.indptr[i]), int(self.indptr[i + 1]))
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.key_names)
+
+    def __len__(self) -> int:
+        return len(self.key_names)
+
+    def __contains__(self, key) -> bool:
+        return key in self.key_ids
+
+    # ---
+
+    @property
+    def shape(self):
+        return len(self.key_names), len(self.item_names)
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indptr[-1])
+
+    @property
+    def nbytes(self) -> int:
+        """ bytes held by the rating arrays (names and id maps excluded) """
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def row_ids(self) -> np.array:
+        """ row id of every stored score, i.e. the COO rows of this matrix """
+        if self._row_ids is None:
+            self._row_ids = np.repeat(
+                np.arange(len(self.key_names), dtype=INDEX_DTYPE), np.diff(self.indptr)
+            )
+        return self._row_ids
+
+    @property
+    def T(self) -> "PrefsMatrix":  # pylint: disable=invalid-name
+        """ item -> {key -> score}, i.e. flip_mapping without building dicts
+
+            The first access builds the item-major arrays (one copy of the scores)
+        """
+        if self._transposed is None:
+            rows = self.row_ids()
+            order = np.argsort(self.indices, kind="stable")
+
+            indptr = np.zeros(len(self.item_names) + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(self.indices, minlength=len(self.item_names)),
+                out=indptr[1:],
+            )
+            transposed = PrefsMatrix(
+                self.item_names, self.key_names, indptr, rows[order], self.data[order]
+            )
+            transposed._transposed = self  # pylint: disable=protected-access
+            self._transposed = transposed
+
+        return self._transposed
+
+    def to_dense(self):
+        """ Returns (values, mask) as (keys x items) arrays in id order """
+        values = np.zeros(self.shape)
+        mask = np.zeros(self.shape)
+        rows = self.row_ids()
+        values[rows, self.indices] = self.data
+        mask[rows, self.indices] = 1.0
+        return values, mask
+
+    def dense_rows(self, rows: Sequence[int]):
+        """ Same as to_dense but only for the given row ids """
+        values = np.zeros((len(rows), len(self.item_names)))
+        mask = np.zeros((len(rows), len(self.item_names)))
+        for n, i in enumerate(rows):
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            values[n, self.indices[start:stop]] = self.data[start:stop]
+            mask[n, self.indices[start:stop]] = 1.0
+        return values, mask
+
+    def _weights(self, power: int) -> np.array:
+        if power == 0:
+            return np.ones(self.data.shape)
+        return self.data.astype(np.float64) ** power
+
+    def dot(self, dense: np.array, *, power: int = 1) -> np.array:
+        """ (keys x k) product of the scores raised to power with dense (items x k)
+
+            power=0 multiplies the 0/1 mask of scored entries instead. Only the
+            stored scores are visited, one column of dense at a time
+        """
+        rows, weights = self.row_ids(), self._weights(power)
+        out = np.zeros((len(self.key_names), dense.shape[1]))
+        for c in range(dense.shape[1]):
+            out[:, c] = np.bincount(
+                rows, weights=weights * dense[self.indices, c], minlength=out.shape[0]
+            )
+        return out
+
+    def rdot(self, dense: np.array, *, power: int = 1) -> np.array:
+        """ (k x items) product of dense (k x keys) with the scores raised to power """
+        rows, weights = self.row_ids(), self._weights(power)
+        out = np.zeros((dense.shape[0], len(self.item_names)))
+        for r in range(dense.shape[0]):
+            out[r] = np.bincount(
+                self.indices, weights=weights * dense[r, rows], minlength=out.shape[1]
+            )
+        return out
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(keys={len(self.key_names)}, "
+            f"items={len(self.item_names)}, nnz={self.nnz})"
+        )
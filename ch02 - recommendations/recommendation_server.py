@@ -0,0 +1,267 @@
+""" Multi-process recommendation server over shared-memory preferences
+
+    The CSR arrays of a PrefsMatrix are copied once into
+    multiprocessing.shared_memory blocks (SharedPrefs). Every worker process of a
+    ProcessPoolExecutor attaches to them read-only, so there is a single copy of
+    the scores whatever the number of workers.
+
+    RecommendationServer is the asyncio front end: concurrent recommend() calls
+    are queued and micro-batched (up to max_batch requests or max_delay seconds)
+    into a single recommend_all(..., users=batch) call on a worker.
+
+    serve() exposes it over TCP with one JSON request per line, e.g.
+
+        {"user": 1, "count": 5}   ->   [[4.8, 318], [4.7, 858], ...]
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prefs_matrix import PrefsMatrix
+from recommendations import recommend_all, similarity_pearson
+
+log = logging.getLogger(__name__)
+
+SHARED_ARRAYS = ("indptr", "indices", "data", "row_ids")
+
+
+class SharedPrefs:
+    """ Owner of the shared-memory copy of a PrefsMatrix
+
+        descriptor is a small picklable dict that attach() turns back into a
+        PrefsMatrix in any process
+    """
+
+    def __init__(self, prefs: PrefsMatrix):
+        arrays = {
+            "indptr": prefs.indptr,
+            "indices": prefs.indices,
+            "data": prefs.data,
+            "row_ids": prefs.row_ids(),
+        }
+        self._blocks: List[SharedMemory] = []
+        self.descriptor: Dict = {
+            "key_names": prefs.key_names,
+            "item_names": prefs.item_names,
+            "arrays": {},
+        }
+        for name, array in arrays.items():
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+            self._blocks.append(block)
+            self.descriptor["arrays"][name] = (block.name, array.dtype.str, array.shape)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _open_block(name: str) -> SharedMemory:
+    # pylint: disable=unexpected-keyword-arg
+    try:
+        # the owner, not the attaching process, unlinks the block (python >= 3.13)
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        return SharedMemory(name=name)
+
+
+def attach(descriptor: Dict) -> Tuple[PrefsMatrix, List[SharedMemory]]:
+    """ Read-only PrefsMatrix over the blocks of a SharedPrefs
+
+        The returned blocks must be kept alive as long as the matrix is used
+    """
+    blocks, arrays = [], {}
+    for name in SHARED_ARRAYS:
+        block_name, dtype, shape = descriptor["arrays"][name]
+        block = _open_block(block_name)
+        array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[name] = array
+
+    prefs = PrefsMatrix(
+        descriptor["key_names"],
+        descriptor["item_names"],
+        arrays["indptr"],
+        arrays["indices"],
+        arrays["data"],
+        row_ids=arrays["row_ids"],
+    )
+    return prefs, blocks
+
+
+# state of every worker process
+_worker_prefs: Optional[PrefsMatrix] = None
+_worker_blocks: List[SharedMemory] = []
+
+
+def _init_worker(descriptor: Dict):
+    global _worker_prefs, _worker_blocks  # pylint: disable=global-statement
+    _worker_prefs, _worker_blocks = attach(descriptor)
+
+
+def _recommend_batch(users: List, count: int, similarity) -> List[Tuple]:
+    return list(
+        recommend_all(
+            _worker_prefs, count, similarity, users=users, chunk_size=len(users)
+        )
+    )
+
+
+class RecommendationServer:
+    def __init__(
+        self,
+        prefs: PrefsMatrix,
+        *,
+        workers: Optional[int] = None,
+        similarity=similarity_pearson,
+        max_batch: int = 64,
+        max_delay: float = 0.005,
+    ):
+        self.prefs = prefs
+        self.workers = workers
+        self.similarity = similarity
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._shared: Optional[SharedPrefs] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._pending = set()
+
+    async def start(self):
+        self._shared = SharedPrefs(self.prefs)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # forked workers would inherit (and keep open) the sockets of the front end
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._shared.descriptor,),
+        )
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._run_batcher())
+
+    async def stop(self):
+        if self._batcher:
+            self._batcher.cancel()
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._pool:
+            self._pool.shutdown()
+        if self._shared:
+            self._shared.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def recommend(self, user, count: int = 5) -> List[Tuple[float, str]]:
+        """ Same result as get_recommendations(user, count=count, prefs=prefs) """
+        if user not in self.prefs:
+            # no similar user, hence nothing to recommend
+            return []
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user, count, future))
+        return await future
+
+    async def _run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # dispatches and goes on collecting the next batch
+            task = asyncio.ensure_future(self._dispatch(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, batch: List[Tuple]):
+        loop = asyncio.get_running_loop()
+        users = list({user: None for user, _, _ in batch})
+        count = max(count for _, count, _ in batch)
+        try:
+            results = dict(
+                await loop.run_in_executor(
+                    self._pool, _recommend_batch, users, count, self.similarity
+                )
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        for user, user_count, future in batch:
+            if not future.done():
+                future.set_result(results[user][:user_count])
+
+
+async def serve(
+    server: RecommendationServer, host: str = "127.0.0.1", port: int = 8765
+):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                result = await server.recommend(
+                    request["user"], request.get("count", 5)
+                )
+                response = [[float(score), item] for score, item in result]
+            except Exception as err:  # pylint: disable=broad-except
+                response = {"error": str(err)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        writer.close()
+
+    async with server:
+        tcp_server = await asyncio.start_server(handle, host, port)
+        log.info("Serving recommendations on %s:%d", host, port)
+        async with tcp_server:
+            await tcp_server.serve_forever()
+
+
+def main():
+    # pylint: disable=import-outside-toplevel
+    from data import movielens
+
+    movielens.download()
+    ratings = movielens.load_columns("ratings.csv")
+    prefs = PrefsMatrix.from_arrays(
+        ratings["userId"], ratings["movieId"], ratings["rating"]
+    )
+    asyncio.run(serve(RecommendationServer(prefs)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
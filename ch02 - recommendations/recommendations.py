@@ -1,10 +1,20 @@
+import heapq
 import logging
 from collections import defaultdict
 from operator import itemgetter
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 
+from prefs_matrix import PrefsMatrix
+from similarity_engine import (
+    DEFAULT_CHUNK_SIZE,
+    pairwise_similarity,
+    rating_matrix,
+    similarity_block,
+    sparse_similarity_block,
+)
+
 # from numpy import linalg as LA
 
 log = logging.getLogger(__name__)
@@ -53,6 +63,8 @@ def similarity_pearson(user1: str, user2: str, *, prefs: Dict[str, Dict]) -> flo
     cross = _var(p1, p2)
     # product of individual variations
     individual = np.sqrt(_var(p1, p1) * _var(p2, p2))
+    if individual == 0:
+        return 0
 
     return cross / individual
 
@@ -61,17 +73,30 @@ SCORE_INDEX = 0
 
 
 def eval_top_matches(
-    user: str, *, count: int = 5, similarity=similarity_pearson, prefs: Dict[str, Dict]
+    user: str,
+    *,
+    count: int = 5,
+    similarity=similarity_pearson,
+    prefs: Dict[str, Dict],
+    index=None,
 ) -> List[Tuple[float, str]]:
-    """ Returns top matches for a given user sorted by similarity """
-    scores = [
+    """ Returns top matches for a given user sorted by similarity
+
+        If an approximate index (e.g. ann_index.LSHIndex) is passed, only its
+        candidates are scored instead of every other user. Users added to prefs
+        after the index was built are scored against everybody
+    """
+    if index is not None and user not in index:
+        log.debug("%s is not in the index, scoring every other user", user)
+        index = None
+    others = prefs if index is None else index.candidates(user)
+    scores = (
         (similarity(user, other, prefs=prefs), other)
-        for other in prefs
+        for other in others
         if other != user
-    ]
+    )
 
-    scores.sort(key=itemgetter(SCORE_INDEX), reverse=True)
-    return scores[:count]
+    return heapq.nlargest(count, scores, key=itemgetter(SCORE_INDEX))
 
 
 def get_recommendations(
@@ -107,6 +132,9 @@ def get_recommendations(
 
 
 def flip_mapping(prefs: Dict[str, Dict]) -> Dict[str, Dict]:
+    if isinstance(prefs, PrefsMatrix):
+        return prefs.T
+
     new_map = defaultdict(dict)
     for key1 in prefs:
         for key2, value in prefs[key1].items():
@@ -114,13 +142,101 @@ def flip_mapping(prefs: Dict[str, Dict]) -> Dict[str, Dict]:
     return new_map
 
 
+# similarities the vectorized engine can evaluate for all pairs at once
+VECTORIZED_METRICS = {similarity_pearson: "pearson", similarity_distance: "distance"}
+
+
 def get_similarity_matrix(
-    prefs: Dict[str, Dict], *, similarity=similarity_pearson
+    prefs: Dict[str, Dict],
+    *,
+    similarity=similarity_pearson,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
 ) -> Tuple[List[str], np.array]:
 
-    keys_order = sorted(prefs.keys())
-    matrix = np.array(
-        [[similarity(p1, p2, prefs=prefs) for p2 in keys_order] for p1 in keys_order]
-    )
+    metric = VECTORIZED_METRICS.get(similarity)
+    if metric is None:
+        # any other callable is evaluated pair by pair
+        keys_order = sorted(prefs.keys())
+        matrix = np.array(
+            [
+                [similarity(p1, p2, prefs=prefs) for p2 in keys_order]
+                for p1 in keys_order
+            ]
+        )
+        return keys_order, matrix
+
+    keys_order, _, values, mask = rating_matrix(prefs)
+    matrix = pairwise_similarity(values, mask, metric=metric, chunk_size=chunk_size)
 
     return keys_order, matrix
+
+
+def recommend_all(
+    prefs: Dict[str, Dict],
+    count: int = 5,
+    similarity=similarity_pearson,
+    *,
+    users: Optional[Sequence[str]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Tuple[str, List[Tuple[float, str]]]]:
+    """ Yields (user, get_recommendations(user, ...)) for every user in prefs
+
+        Users are scored chunk_size at a time: with S the positive similarities of a
+        chunk against everybody else, the weighted sums of get_recommendations are
+        S @ values and its totals S @ mask. A PrefsMatrix is read straight from its
+        CSR arrays instead of being densified
+    """
+    if isinstance(prefs, PrefsMatrix):
+        keys, items = prefs.key_names, prefs.item_names
+        values = mask = None
+    else:
+        keys, items, values, mask = rating_matrix(prefs)
+
+    key_ids = {key: i for i, key in enumerate(keys)}
+    targets = np.array(
+        [key_ids[user] for user in (keys if users is None else users)], dtype=int
+    )
+    metric = VECTORIZED_METRICS.get(similarity)
+
+    for start in range(0, targets.size, chunk_size):
+        rows = targets[start : start + chunk_size]
+
+        if metric is None:
+            sim = np.array(
+                [
+                    [similarity(keys[i], other, prefs=prefs) for other in keys]
+                    for i in rows
+                ]
+            ).reshape(rows.size, len(keys))
+        elif values is None:
+            sim = sparse_similarity_block(prefs, rows, metric=metric)
+        else:
+            sim = similarity_block(values, mask, rows, slice(None), metric=metric)
+
+        sim[np.arange(rows.size), rows] = 0.0
+        sim[sim < 0] = 0.0
+
+        if values is None:
+            totals = prefs.rdot(sim, power=0)
+            weighted = prefs.rdot(sim)
+            rated = prefs.dense_rows(rows)[1]
+        else:
+            totals = sim @ mask
+            weighted = sim @ values
+            rated = mask[rows]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = weighted / totals
+        scores[(totals <= 0) | (rated > 0)] = -np.inf
+        # partial sort: only the top candidates of every row get ordered
+        top = min(count, len(items))
+        if top > 0:
+            best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+        else:
+            best = np.empty((rows.size, 0), dtype=int)
+
+        for n, i in enumerate(rows):
+            cols = best[n][np.argsort(-scores[n, best[n]], kind="stable")]
+            yield keys[i], [
+                (scores[n, j], items[j]) for j in cols if scores[n, j] > -np.inf
+            ]
@@ -0,0 +1,110 @@
+""" Bounded LRU cache of similarities with per-user invalidation
+
+    Most pairs of users do not change between two get_recommendations calls, so
+
+        cache = SimilarityCache(maxsize=100_000)
+        similarity = cache.wrap(similarity_pearson)
+
+        get_recommendations(user, similarity=similarity, prefs=prefs)
+        ...
+        prefs[user][item] = score
+        cache.invalidate(user)
+
+    Every user has a version counter and entries remember the versions of both users
+    when they were computed. invalidate(user) only bumps the counter (O(1)): the
+    entries of that user are detected as stale, and dropped, the next time they are
+    looked up while the rest of the cache stays valid
+"""
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class SimilarityCache:
+    def __init__(self, maxsize: int = 100_000, *, symmetric: bool = True):
+        """ symmetric: similarity(a, b) == similarity(b, a), i.e. one entry per pair """
+        self.maxsize = maxsize
+        self.symmetric = symmetric
+
+        # (user, other, metric) -> (similarity, version of user, version of other)
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, int]]" = OrderedDict()
+        self._versions: Dict[Hashable, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0  # misses due to an invalidated user
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def version(self, user: Hashable) -> int:
+        return self._versions.get(user, 0)
+
+    def invalidate(self, user: Hashable):
+        """ Call when the ratings of user change """
+        self._versions[user] = self.version(user) + 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(
+        self,
+        user: Hashable,
+        other: Hashable,
+        metric: Hashable,
+        compute: Callable[[], float],
+    ) -> float:
+        if self.symmetric and other < user:
+            user, other = other, user
+        key = (user, other, metric)
+        versions = (self.version(user), self.version(other))
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1:] == versions:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            self.stale += 1
+            del self._entries[key]
+
+        self.misses += 1
+        value = compute()
+        self._entries[key] = (value, *versions)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def wrap(self, similarity: Callable, metric: Optional[Hashable] = None) -> Callable:
+        """ Cached version of a similarity(user1, user2, *, prefs) function
+
+            Its entries are keyed by metric, the similarity object itself by
+            default: two closures or lambdas never share entries
+        """
+        metric = similarity if metric is None else metric
+
+        @wraps(similarity)
+        def cached(user1, user2, *, prefs):
+            return self.get(
+                user1, user2, metric, lambda: similarity(user1, user2, prefs=prefs)
+            )
+
+        return cached
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(maxsize={self.maxsize}, {self.stats})"
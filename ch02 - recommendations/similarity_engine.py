@@ -0,0 +1,144 @@
+""" Vectorized all-pairs similarities
+
+    The preferences are packed once into a dense (keys x items) matrix of values R
+    and a 0/1 mask M of rated entries. The sums over co-rated items that
+    similarity_pearson and similarity_distance evaluate pair by pair are then
+    a handful of matrix products between blocks of rows, e.g.
+
+        n(a, b)   = M_a . M_b      # number of co-rated items
+        Σx(a, b)  = R_a . M_b      # a's ratings on the items b also rated
+        Σxy(a, b) = R_a . R_b      # missing values are zeros
+"""
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from prefs_matrix import PrefsMatrix
+
+log = logging.getLogger(__name__)
+
+METRICS = ("pearson", "distance")
+DEFAULT_CHUNK_SIZE = 512
+
+
+def rating_matrix(
+    prefs: Dict[str, Dict], keys_order: Optional[Sequence[str]] = None
+) -> Tuple[List[str], List[str], np.array, np.array]:
+    """ Packs prefs into (keys, items, values, mask) with one row per key """
+    keys = sorted(prefs.keys()) if keys_order is None else list(keys_order)
+
+    if isinstance(prefs, PrefsMatrix):
+        values, mask = prefs.to_dense()
+        rows = [prefs.key_ids[key] for key in keys]
+        return keys, prefs.item_names, values[rows], mask[rows]
+
+    items = sorted(set().union(*(prefs[key].keys() for key in keys)))
+    item_index = {item: j for j, item in enumerate(items)}
+
+    values = np.zeros((len(keys), len(items)))
+    mask = np.zeros((len(keys), len(items)))
+    for i, key in enumerate(keys):
+        row = prefs[key]
+        cols = [item_index[item] for item in row]
+        values[i, cols] = list(row.values())
+        mask[i, cols] = 1.0
+
+    return keys, items, values, mask
+
+
+def _from_sums(n, sx, sy, sxx, syy, sxy, metric: str) -> np.array:
+    """ Similarities from the sums over co-rated items (x for rows, y for columns) """
+    if metric == "distance":
+        squared = sxx + syy - 2.0 * sxy
+        np.maximum(squared, 0.0, out=squared)
+        sim = 1.0 / (1.0 + np.sqrt(squared))
+        sim[n == 0] = 0.0
+        return sim
+
+    if metric != "pearson":
+        raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # how much variables change together
+        cross = sxy - sx * sy / n
+        # product of individual variations
+        individual = np.sqrt((sxx - sx * sx / n) * (syy - sy * sy / n))
+        sim = cross / individual
+
+    sim[(n <= 1) | ~(individual > 0)] = 0.0
+    return sim
+
+
+def similarity_block(
+    values: np.array,
+    mask: np.array,
+    rows: Union[slice, np.array],
+    cols: Union[slice, np.array],
+    *,
+    metric: str = "pearson",
+) -> np.array:
+    """ Similarities between rows[i] and cols[j] computed over co-rated items """
+    x, mx = values[rows], mask[rows]
+    y, my = values[cols], mask[cols]
+
+    return _from_sums(
+        mx @ my.T, x @ my.T, mx @ y.T, (x * x) @ my.T, mx @ (y * y).T, x @ y.T, metric,
+    )
+
+
+def sparse_similarity_block(
+    prefs: PrefsMatrix, rows: Sequence[int], *, metric: str = "pearson"
+) -> np.array:
+    """ Similarities between the given row ids and every key of prefs
+
+        Same as similarity_block on prefs.to_dense() but the other keys are read
+        straight from the CSR arrays, i.e. nothing of size keys x items is allocated
+    """
+    x, mx = prefs.dense_rows(rows)
+    size = len(rows)
+
+    # sums where the columns' scores enter with power 0 (mask), 1 and 2
+    masked = prefs.dot(np.vstack([mx, x, x * x]).T, power=0).T
+    scored = prefs.dot(np.vstack([mx, x]).T, power=1).T
+    squared = prefs.dot(mx.T, power=2).T
+
+    return _from_sums(
+        masked[:size],
+        masked[size : 2 * size],
+        scored[:size],
+        masked[2 * size :],
+        squared,
+        scored[size:],
+        metric,
+    )
+
+
+def pairwise_similarity(
+    values: np.array,
+    mask: np.array,
+    *,
+    metric: str = "pearson",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> np.array:
+    """ Symmetric (keys x keys) similarity matrix
+
+        Only the upper triangle of blocks is evaluated, chunk_size rows at a time,
+        and mirrored into the lower one
+    """
+    size = values.shape[0]
+    matrix = np.zeros((size, size))
+
+    starts = range(0, size, chunk_size)
+    for i in starts:
+        rows = slice(i, min(i + chunk_size, size))
+        for j in starts:
+            if j < i:
+                continue
+            cols = slice(j, min(j + chunk_size, size))
+            block = similarity_block(values, mask, rows, cols, metric=metric)
+            matrix[rows, cols] = block
+            matrix[cols, rows] = block.T
+        log.debug("similarity rows %d-%d of %d done", rows.start, rows.stop, size)
+
+    return matrix
@@ -0,0 +1,30 @@
+import numpy as np
+
+from data.movies import critics
+from factorization import FactorModel
+
+
+def test_train():
+    model = FactorModel.train(
+        critics, factors=4, reg=0.01, iterations=10, holdout=0.0, seed=0
+    )
+
+    # without holdout all the iterations run, each lowering the error
+    train_rmse = [train for train, _ in model.history]
+    assert len(train_rmse) == 10
+    assert (np.diff(train_rmse) <= 1e-6).all()
+    assert train_rmse[-1] < 0.1
+
+
+def test_recommendations_skip_scored():
+    model = FactorModel.train(critics, factors=4, iterations=5, holdout=0.0, seed=0)
+
+    recommended = model.get_recommendations("Toby", count=10)
+
+    assert [item for _, item in recommended] and not any(
+        item in critics["Toby"] for _, item in recommended
+    )
+    assert len(recommended) == len(model.items) - len(critics["Toby"])
+    scores = [score for score, _ in recommended]
+    assert scores == sorted(scores, reverse=True)
+    assert model.get_recommendations("Nobody") == []
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+from data.movies import critics
+from incremental_similarity import PearsonIndex
+from recommendations import similarity_pearson
+
+
+def assert_same_similarities(index: PearsonIndex, prefs):
+    def rated(prefs):
+        return {user: ratings for user, ratings in prefs.items() if ratings}
+
+    assert rated(index.prefs) == rated(prefs)
+    users = sorted(prefs)
+    for user in users:
+        for other in users:
+            assert index.similarity(user, other) == pytest.approx(
+                similarity_pearson(user, other, prefs=prefs), abs=1e-9
+            )
+
+
+def test_from_prefs():
+    index = PearsonIndex(critics)
+
+    assert_same_similarities(index, critics)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_stream(seed):
+    rng = random.Random(seed)
+    users = [f"user {i}" for i in range(6)]
+    items = [f"item {j}" for j in range(8)]
+    index = PearsonIndex()
+    prefs = {user: {} for user in users}
+
+    for step in range(300):
+        user, item = rng.choice(users), rng.choice(items)
+        if item in prefs[user] and rng.random() < 0.4:
+            index.remove_rating(user, item)
+            del prefs[user][item]
+        else:
+            # adds, or updates an existing score; halves keep the sums exact
+            score = rng.randint(2, 10) / 2
+            index.add_rating(user, item, score)
+            prefs[user][item] = score
+
+        if step % 20 == 0:
+            assert_same_similarities(index, prefs)
+    assert_same_similarities(index, prefs)
+
+    # the statistics of pairs without co-rated items are dropped
+    rated = {user: set(ratings) for user, ratings in prefs.items()}
+    sharing = sum(1 for a in users for b in users if a < b and rated[a] & rated[b])
+    assert len(index) == sharing
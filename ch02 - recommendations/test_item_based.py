@@ -0,0 +1,54 @@
+import numpy as np
+
+import pytest
+from data.movies import critics
+from item_based import ItemNeighbours, get_item_recommendations
+from recommendations import (
+    eval_top_matches,
+    flip_mapping,
+    similarity_distance,
+    similarity_pearson,
+)
+
+
+def pair_by_pair(item1, item2, *, prefs):
+    # not vectorized: built with the similarity itself
+    return similarity_distance(item1, item2, prefs=prefs)
+
+
+@pytest.mark.parametrize(
+    "similarity", [similarity_pearson, similarity_distance, pair_by_pair]
+)
+@pytest.mark.parametrize("k", [3, 20])
+def test_build(similarity, k):
+    item_prefs = flip_mapping(critics)
+
+    table = ItemNeighbours.build(critics, k=k, similarity=similarity, chunk_size=4)
+
+    assert table.k == min(k, len(item_prefs) - 1)
+    for item in item_prefs:
+        expected = eval_top_matches(
+            item, count=table.k, similarity=similarity, prefs=item_prefs
+        )
+        result = table.most_similar(item)
+        # ties may come in any order
+        assert [sim for sim, _ in result] == pytest.approx(
+            [sim for sim, _ in expected], abs=1e-6
+        )
+        if table.k == len(item_prefs) - 1:
+            assert {other for _, other in result} == {other for _, other in expected}
+
+
+def test_save_load(tmp_path):
+    table = ItemNeighbours.build(critics)
+
+    table.save(tmp_path / "table")
+    loaded = ItemNeighbours.load(tmp_path / "table")
+
+    assert isinstance(loaded.neighbours, np.memmap)
+    assert loaded.items == table.items
+    for item in table.items:
+        assert loaded.most_similar(item) == table.most_similar(item)
+    assert get_item_recommendations(
+        "Toby", neighbours=loaded, prefs=critics
+    ) == get_item_recommendations("Toby", neighbours=table, prefs=critics)
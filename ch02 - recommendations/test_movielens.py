@@ -0,0 +1,60 @@
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+from data import movielens
+
+CSV = (
+    "userId,movieId,rating,timestamp\n"
+    "1,10,4.0,964982703\n"
+    "1,20,3.5,964981247\n"
+    "2,10,5.0,964982224\n"
+)
+
+
+@pytest.fixture()
+def local(tmp_path, monkeypatch):
+    monkeypatch.setattr(movielens, "local_dir", tmp_path)
+    monkeypatch.setattr(movielens, "cache_dir", tmp_path / "cache")
+    (tmp_path / "ratings.csv").write_text(CSV)
+    return tmp_path
+
+
+def test_convert(local):
+    target = movielens.convert("ratings.csv")
+
+    assert sorted(path.name for path in target.iterdir()) == [
+        "manifest.json",
+        "movieId.npy",
+        "rating.npy",
+        "timestamp.npy",
+        "userId.npy",
+    ]
+    # no staging folder left behind
+    assert [path.name for path in (local / "cache").iterdir()] == ["ratings"]
+
+
+def test_load_columns(local, monkeypatch):
+    columns = movielens.load_columns("ratings.csv")
+
+    assert isinstance(columns["rating"], np.memmap)
+    assert columns["userId"].dtype == np.int32
+    assert columns["rating"].dtype == np.float16
+    np.testing.assert_array_equal(columns["movieId"], [10, 20, 10])
+    np.testing.assert_array_equal(columns["rating"], [4.0, 3.5, 5.0])
+
+    # up to date: nothing is converted again
+    def fail(filename):
+        raise AssertionError("converted again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(movielens, "convert", fail)
+        again = movielens.load_columns("ratings.csv")
+    np.testing.assert_array_equal(again["rating"], columns["rating"])
+
+    # the csv changed: converted again, while the old maps stay readable
+    (local / "ratings.csv").write_text(CSV + "3,30,1.5,964982931\n")
+    updated = movielens.load_columns("ratings.csv")
+    np.testing.assert_array_equal(updated["rating"], [4.0, 3.5, 5.0, 1.5])
+    np.testing.assert_array_equal(columns["rating"], [4.0, 3.5, 5.0])
@@ -0,0 +1,65 @@
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+from data.movies import critics
+from prefs_matrix import PrefsMatrix
+from recommendations import flip_mapping
+
+
+@pytest.fixture()
+def matrix():
+    return PrefsMatrix.from_dict(critics)
+
+
+def test_mapping_protocol(matrix):
+    assert len(matrix) == len(critics)
+    assert list(matrix) == list(critics)
+    assert "Toby" in matrix and "Nobody" not in matrix
+    with pytest.raises(KeyError):
+        matrix["Nobody"]  # pylint: disable=pointless-statement
+
+    for user, ratings in critics.items():
+        row = matrix[user]
+        assert len(row) == len(ratings)
+        assert dict(row) == ratings
+        assert dict(row.items()) == ratings
+        assert sorted(row.values()) == sorted(ratings.values())
+        for item, score in ratings.items():
+            assert item in row
+            assert row[item] == score
+        assert "Unknown Movie" not in row
+        with pytest.raises(KeyError):
+            row["Unknown Movie"]  # pylint: disable=pointless-statement
+
+
+def test_transposed(matrix):
+    flipped = flip_mapping(critics)
+
+    assert {item: dict(row) for item, row in matrix.T.items()} == flipped
+    assert matrix.T.T is matrix
+
+
+def test_from_arrays_duplicates():
+    keys = ["a", "b", "a", "a", "b"]
+    items = ["x", "x", "y", "x", "y"]
+    scores = [1.0, 2.0, 3.0, 4.0, 5.0]
+
+    matrix = PrefsMatrix.from_arrays(keys, items, scores)
+
+    assert dict(matrix["a"]) == {"x": 4.0, "y": 3.0}
+    assert dict(matrix["b"]) == {"x": 2.0, "y": 5.0}
+    assert len(matrix["a"]) == 2
+    assert matrix.nnz == 4
+    np.testing.assert_array_equal(matrix.rdot(np.ones((1, 2))), [[6.0, 8.0]])
+    assert dict(matrix.T["x"]) == {"a": 4.0, "b": 2.0}
+
+
+def test_from_coo_lists():
+    matrix = PrefsMatrix.from_coo(
+        ["a", "b"], ["x", "y"], [0, 1, 0], [0, 0, 1], [1.0, 2.0, 3.0]
+    )
+
+    assert dict(matrix["a"]) == {"x": 1.0, "y": 3.0}
+    assert dict(matrix["b"]) == {"x": 2.0}
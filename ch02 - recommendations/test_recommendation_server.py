@@ -0,0 +1,76 @@
+# pylint:disable=redefined-outer-name
+
+import asyncio
+import json
+import socket
+from contextlib import suppress
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+from data.movies import critics
+from prefs_matrix import PrefsMatrix
+from recommendation_server import RecommendationServer, SharedPrefs, attach, serve
+from recommendations import get_recommendations
+
+
+@pytest.fixture()
+def prefs():
+    return PrefsMatrix.from_dict(critics)
+
+
+@pytest.fixture()
+def port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def assert_unlinked(descriptor):
+    for block_name, _, _ in descriptor["arrays"].values():
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=block_name)
+
+
+def test_shared_prefs(prefs):
+    with SharedPrefs(prefs) as shared:
+        attached, blocks = attach(shared.descriptor)
+
+        assert list(attached) == list(prefs)
+        assert {user: dict(row) for user, row in attached.items()} == critics
+        assert not attached.data.flags.writeable
+        del attached
+        for block in blocks:
+            block.close()
+
+    assert_unlinked(shared.descriptor)
+
+
+def test_serve(prefs, port):
+    server = RecommendationServer(prefs, workers=1)
+
+    async def request(line: bytes):
+        serving = asyncio.ensure_future(serve(server, port=port))
+        for _ in range(200):
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        writer.write(line)
+        response = json.loads(await reader.readline())
+        writer.close()
+
+        serving.cancel()
+        with suppress(asyncio.CancelledError):
+            await serving
+        return response
+
+    response = asyncio.run(request(b'{"user": "Toby", "count": 3}\n'))
+
+    expected = get_recommendations("Toby", count=3, prefs=critics)
+    assert [item for _, item in response] == [item for _, item in expected]
+    assert [score for score, _ in response] == pytest.approx(
+        [score for score, _ in expected]
+    )
+    # shutting down releases the shared memory
+    assert_unlinked(server._shared.descriptor)  # pylint: disable=protected-access
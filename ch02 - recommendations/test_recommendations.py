@@ -0,0 +1,83 @@
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+from ann_index import LSHIndex
+from data.movies import critics
+from prefs_matrix import PrefsMatrix
+from recommendations import (
+    eval_top_matches,
+    get_recommendations,
+    get_similarity_matrix,
+    recommend_all,
+    similarity_distance,
+    similarity_pearson,
+)
+
+
+@pytest.fixture()
+def prefs():
+    prefs = {user: dict(ratings) for user, ratings in critics.items()}
+    # no item in common with anybody
+    prefs["Loner"] = {"Unknown Movie": 4.0}
+    # a single item in common with most critics
+    prefs["One Shared"] = {"Superman Returns": 4.0, "Unknown Movie 2": 1.0}
+    return prefs
+
+
+@pytest.mark.parametrize("similarity", [similarity_pearson, similarity_distance])
+@pytest.mark.parametrize("chunk_size", [3, 512])
+def test_similarity_matrix(prefs, similarity, chunk_size):
+    keys, matrix = get_similarity_matrix(
+        prefs, similarity=similarity, chunk_size=chunk_size
+    )
+
+    assert keys == sorted(prefs)
+    expected = np.array(
+        [[similarity(user, other, prefs=prefs) for other in keys] for user in keys]
+    )
+    np.testing.assert_allclose(matrix, expected, atol=1e-9)
+
+
+def test_similarity_few_shared_items(prefs):
+    keys, pearson = get_similarity_matrix(prefs, similarity=similarity_pearson)
+    _, distance = get_similarity_matrix(prefs, similarity=similarity_distance)
+    loner, one_shared = keys.index("Loner"), keys.index("One Shared")
+    others = [i for i in range(len(keys)) if i not in (loner, one_shared)]
+
+    # nothing in common
+    assert (pearson[loner, others] == 0).all()
+    assert (distance[loner, others] == 0).all()
+    # a single co-rated item: no correlation, but a distance
+    assert (pearson[one_shared, others] == 0).all()
+    lisa = keys.index("Lisa Rose")
+    assert distance[one_shared, lisa] == pytest.approx(1 / (1 + abs(4.0 - 3.5)))
+
+
+@pytest.mark.parametrize("similarity", [similarity_pearson, similarity_distance])
+@pytest.mark.parametrize("as_matrix", [False, True])
+def test_recommend_all(prefs, similarity, as_matrix):
+    data = PrefsMatrix.from_dict(prefs) if as_matrix else prefs
+
+    results = dict(recommend_all(data, 3, similarity, chunk_size=4))
+
+    assert set(results) == set(prefs)
+    for user, recommended in results.items():
+        expected = get_recommendations(
+            user, count=3, similarity=similarity, prefs=prefs
+        )
+        assert [name for _, name in recommended] == [name for _, name in expected]
+        np.testing.assert_allclose(
+            [score for score, _ in recommended], [score for score, _ in expected]
+        )
+
+
+def test_top_matches_user_not_indexed(prefs):
+    index = LSHIndex(critics, seed=0)
+    prefs["Newcomer"] = dict(prefs["Lisa Rose"])
+
+    matches = eval_top_matches("Newcomer", count=3, prefs=prefs, index=index)
+
+    assert matches == eval_top_matches("Newcomer", count=3, prefs=prefs)
+    assert matches[0] == (pytest.approx(1.0), "Lisa Rose")
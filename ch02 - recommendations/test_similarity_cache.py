@@ -0,0 +1,92 @@
+import pytest
+from data.movies import critics
+from recommendations import (
+    get_recommendations,
+    similarity_distance,
+    similarity_pearson,
+)
+from similarity_cache import SimilarityCache
+
+
+def counting(similarity, calls):
+    def wrapped(user1, user2, *, prefs):
+        calls.append((user1, user2))
+        return similarity(user1, user2, prefs=prefs)
+
+    return wrapped
+
+
+def test_hits_and_invalidation():
+    prefs = {user: dict(ratings) for user, ratings in critics.items()}
+    cache = SimilarityCache()
+    calls = []
+    similarity = cache.wrap(counting(similarity_pearson, calls))
+
+    expected = get_recommendations("Toby", similarity=similarity, prefs=prefs)
+    others = len(prefs) - 1
+    assert cache.stats == {
+        "size": others,
+        "hits": 0,
+        "misses": others,
+        "stale": 0,
+        "evictions": 0,
+    }
+
+    # symmetric: the same pairs seen from the other side
+    for other in prefs:
+        if other != "Toby":
+            similarity(other, "Toby", prefs=prefs)
+    assert cache.hits == others
+    assert len(calls) == others
+
+    # only the pairs of the updated user are recomputed
+    prefs["Lisa Rose"]["Superman Returns"] = 1.0
+    cache.invalidate("Lisa Rose")
+    calls.clear()
+
+    result = get_recommendations("Toby", similarity=similarity, prefs=prefs)
+    assert calls == [("Toby", "Lisa Rose")]
+    assert cache.stale == 1
+    assert cache.hits == 2 * others - 1
+    assert similarity("Toby", "Lisa Rose", prefs=prefs) == pytest.approx(
+        similarity_pearson("Toby", "Lisa Rose", prefs=prefs)
+    )
+    assert result != expected
+
+
+def test_eviction():
+    cache = SimilarityCache(maxsize=2)
+
+    for other in "bcd":
+        cache.get("a", other, "metric", lambda: 1.0)
+    cache.get("a", "b", "metric", lambda: 2.0)
+
+    assert len(cache) == 2
+    assert cache.evictions == 2
+    assert cache.misses == 4 and cache.hits == 0
+
+
+def test_same_qualname():
+    def make(similarity):
+        def wrapped(user1, user2, *, prefs):
+            return similarity(user1, user2, prefs=prefs)
+
+        return wrapped
+
+    cache = SimilarityCache()
+    pearson = cache.wrap(make(similarity_pearson))
+    distance = cache.wrap(make(similarity_distance))
+    ones = cache.wrap(lambda user1, user2, *, prefs: 1.0)
+    twos = cache.wrap(lambda user1, user2, *, prefs: 2.0)
+
+    args = ("Toby", "Lisa Rose")
+    assert pearson(*args, prefs=critics) == similarity_pearson(*args, prefs=critics)
+    assert distance(*args, prefs=critics) == similarity_distance(*args, prefs=critics)
+    assert (ones(*args, prefs=critics), twos(*args, prefs=critics)) == (1.0, 2.0)
+    assert cache.hits == 0
+
+    # an explicit metric name shares the entries on purpose
+    named = cache.wrap(make(similarity_pearson), metric="pearson")
+    again = cache.wrap(make(similarity_pearson), metric="pearson")
+    assert named(*args, prefs=critics) == again(*args, prefs=critics)
+    assert cache.hits == 1
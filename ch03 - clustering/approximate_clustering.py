@@ -0,0 +1,292 @@
+""" Approximate hierarchical clustering for tables too large for hcluster
+
+    Exact clustering needs the n (n - 1) / 2 distances in memory. Instead,
+    approximate_hcluster
+     1. compresses the rows into n_clusters groups with mini-batch k-means, which
+        streams over the table in batches,
+     2. runs the exact hcluster_linkage on the rows of every group, and on the
+        centroids of the groups to join them,
+    so the largest distance array is that of the largest group, or of the
+    centroids. The result is a LinkageMatrix over all the original rows.
+
+    Its quality is measured on a random sample of rows: their cophenetic
+    distances (the height of the merge joining two rows) in the approximate tree
+    are compared with those of an exact clustering of the sample
+"""
+import heapq
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from hcluster_algorithms import (
+    LinkageMatrix,
+    condensed_distances,
+    hcluster_linkage,
+)
+from metrics import pearson_distance, standardise
+
+log = logging.getLogger(__name__)
+
+
+def _squared_distances(X: np.array, centres: np.array) -> np.array:
+    return (
+        (X * X).sum(axis=1)[:, np.newaxis]
+        + (centres * centres).sum(axis=1)
+        - 2 * X @ centres.T
+    )
+
+
+def assign(X: np.array, centres: np.array, *, batch_size: int = 4096) -> np.array:
+    """ index of the closest centre (euclidean) of every row, batch_size at a time """
+    labels = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), batch_size):
+        block = X[start : start + batch_size]
+        labels[start : start + batch_size] = _squared_distances(block, centres).argmin(
+            axis=1
+        )
+    return labels
+
+
+def _init_centres(
+    X: np.array, n_clusters: int, rng: np.random.Generator, *, sample: int
+) -> np.array:
+    """ greedy k-means++ seeding over a random sample of the rows
+
+        Every step draws a few candidates with probability proportional to their
+        squared distance to the closest centre, and keeps the one that reduces the
+        most the sum of these distances
+    """
+    rows = X[rng.choice(len(X), max(n_clusters, min(sample, len(X))), replace=False)]
+    trials = 2 + int(np.log(n_clusters))
+    centres = [rows[rng.integers(len(rows))]]
+    closest = _squared_distances(rows, np.array(centres))[:, 0].clip(0)
+    for _ in range(n_clusters - 1):
+        total = closest.sum()
+        if total > 0:
+            candidates = rng.choice(len(rows), trials, p=closest / total)
+        else:
+            candidates = rng.integers(len(rows), size=trials)
+        distances = np.minimum(
+            closest, _squared_distances(rows[candidates], rows).clip(0)
+        )
+        best = distances.sum(axis=1).argmin()
+        centres.append(rows[candidates[best]])
+        closest = distances[best]
+    return np.array(centres, dtype=float)
+
+
+def minibatch_kmeans(
+    X: np.array,
+    n_clusters: int,
+    *,
+    batch_size: int = 1024,
+    iterations: int = 100,
+    seed: Optional[int] = None,
+) -> Tuple[np.array, np.array]:
+    """ (centres, labels) of euclidean mini-batch k-means (Sculley, 2010)
+
+        Centres are seeded with k-means++ on a sample of 3 batches. Every centre
+        moves towards the mean of the rows of each batch assigned to it, with a
+        learning rate of 1 / (rows assigned to it so far)
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(X))
+    centres = _init_centres(X, n_clusters, rng, sample=3 * batch_size)
+    counts = np.zeros(n_clusters)
+
+    for _ in range(iterations):
+        batch = X[rng.integers(0, len(X), min(batch_size, len(X)))]
+        labels = _squared_distances(batch, centres).argmin(axis=1)
+
+        sums = np.zeros_like(centres)
+        np.add.at(sums, labels, batch)
+        batch_counts = np.bincount(labels, minlength=n_clusters)
+
+        seen = batch_counts > 0
+        counts[seen] += batch_counts[seen]
+        centres[seen] += (
+            sums[seen] - batch_counts[seen, np.newaxis] * centres[seen]
+        ) / counts[seen, np.newaxis]
+
+    return centres, assign(X, centres, batch_size=batch_size)
+
+
+def _compose(
+    table: np.array, groups: List[np.array], parts: List[Optional[LinkageMatrix]], top
+) -> LinkageMatrix:
+    """ One LinkageMatrix: the trees of the groups joined by the tree of the top
+
+        The merges of all the trees are interleaved by increasing distance, each
+        tree keeping its own order, and a merge of the top only comes once the
+        groups it joins are complete. So with monotone trees, the distances of Z
+        only decrease where a merge of the top is lower than the root of a group
+        it joins (rows of a group further apart than its centroid from the next
+        one): an inversion, as centroid linkage can give anyway
+    """
+    n = len(table)
+    Z = np.zeros((n - 1, 4))
+    sizes = np.ones(2 * n - 1)
+    k = 0
+
+    def add(left: int, right: int, distance: float) -> int:
+        nonlocal k
+        sizes[n + k] = sizes[left] + sizes[right]
+        Z[k] = left, right, distance, sizes[n + k]
+        k += 1
+        return n + k - 1
+
+    # the merges of every group, then of the top, and their local id -> global id
+    trees = [part.Z.tolist() if part is not None else [] for part in parts]
+    trees.append(top.Z.tolist() if top is not None else [])
+    ids = [list(members) for members in groups] + [[]]
+    done = [0] * len(trees)
+    t_top = len(groups)
+
+    def global_id(t: int, local: float) -> int:
+        local = int(local)
+        if t < t_top:
+            return ids[t][local]
+        # the top joins groups (their root) and its own clusters
+        return ids[local][-1] if local < t_top else ids[t_top][local - t_top]
+
+    def ready(t: int) -> bool:
+        if done[t] == len(trees[t]):
+            return False
+        left, right = trees[t][done[t]][:2]
+        return t < t_top or all(
+            c >= t_top or done[c] == len(trees[c]) for c in (int(left), int(right))
+        )
+
+    queued = {t for t in range(len(trees)) if ready(t)}
+    heap = [(trees[t][0][2], t) for t in queued]
+    heapq.heapify(heap)
+    while heap:
+        _, t = heapq.heappop(heap)
+        queued.remove(t)
+        left, right, distance, _ = trees[t][done[t]]
+        ids[t].append(add(global_id(t, left), global_id(t, right), distance))
+        done[t] += 1
+        for u in (t, t_top):
+            if u not in queued and ready(u):
+                queued.add(u)
+                heapq.heappush(heap, (trees[u][done[u]][2], u))
+
+    centroids = np.empty((2 * n - 1,) + table.shape[1:])
+    centroids[:n] = table
+    for step, (left, right, _, _) in enumerate(Z.tolist()):
+        centroids[n + step] = 0.5 * (centroids[int(left)] + centroids[int(right)])
+    return LinkageMatrix(Z, centroids)
+
+
+def cophenetic(Z: np.array, leaves: np.array) -> np.array:
+    """ Condensed cophenetic distances between the given leaves of Z
+
+        i.e. the distance of the merge where each pair of them is first joined
+    """
+    n = len(Z) + 1
+    position = {int(leaf): p for p, leaf in enumerate(leaves)}
+    m = len(leaves)
+    result = np.empty(m * (m - 1) // 2)
+
+    # sample positions under every node, dropped once merged
+    under: Dict[int, List[int]] = {leaf: [p] for leaf, p in position.items()}
+    for k, (left, right, distance, _) in enumerate(Z.tolist()):
+        a = under.pop(int(left), [])
+        b = under.pop(int(right), [])
+        for p in a:
+            for q in b:
+                i, j = min(p, q), max(p, q)
+                result[m * i - i * (i + 1) // 2 + (j - i - 1)] = distance
+        if a or b:
+            under[n + k] = a + b
+    return result
+
+
+def cophenetic_report(
+    table: np.array,
+    result: LinkageMatrix,
+    distance_fun=pearson_distance,
+    linkage: str = "centroid",
+    *,
+    sample: int = 200,
+    seed: Optional[int] = None,
+) -> Dict[str, float]:
+    """ Compares the approximate tree with an exact clustering of a sample of rows
+
+        - cophenetic_mae: mean absolute difference of their cophenetic distances
+        - cophenetic_correlation: correlation of the cophenetic distances of the
+          approximate tree with the real ones (exact_cophenetic_correlation for
+          the exact tree, as a reference)
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(table), min(sample, len(table)), replace=False))
+    if len(rows) < 3:
+        return {"sample": len(rows)}
+
+    real = condensed_distances(table[rows], distance_fun)
+    exact = cophenetic(
+        hcluster_linkage(table[rows], distance_fun, linkage).Z, np.arange(len(rows))
+    )
+    approx = cophenetic(result.Z, rows)
+
+    return {
+        "sample": len(rows),
+        "cophenetic_mae": float(np.abs(approx - exact).mean()),
+        "cophenetic_correlation": float(np.corrcoef(approx, real)[0, 1]),
+        "exact_cophenetic_correlation": float(np.corrcoef(exact, real)[0, 1]),
+    }
+
+
+def approximate_hcluster(
+    table: np.array,
+    distance_fun=pearson_distance,
+    linkage: str = "centroid",
+    *,
+    n_clusters: Optional[int] = None,
+    batch_size: int = 1024,
+    iterations: int = 100,
+    sample: int = 200,
+    seed: Optional[int] = None,
+) -> Tuple[LinkageMatrix, Dict[str, float]]:
+    """ Approximate hcluster_linkage of table and its cophenetic_report
+
+        n_clusters defaults to sqrt(n), which balances the size of the groups with
+        the number of centroids. For pearson_distance k-means runs on standardised
+        rows, where the euclidean distance is monotonic with pearson's
+    """
+    table = np.asarray(table, dtype=float)
+    n = len(table)
+    if n == 0:
+        raise ValueError("no rows to cluster")
+    n_clusters = n_clusters or max(1, int(np.sqrt(n)))
+
+    space = standardise(table)[0] if distance_fun is pearson_distance else table
+    _, labels = minibatch_kmeans(
+        space, n_clusters, batch_size=batch_size, iterations=iterations, seed=seed
+    )
+
+    groups = [np.flatnonzero(labels == c) for c in range(labels.max() + 1)]
+    groups = [members for members in groups if len(members)]
+    log.info(
+        "%d rows in %d groups, the largest of %d",
+        n,
+        len(groups),
+        max(len(members) for members in groups),
+    )
+
+    parts = [
+        hcluster_linkage(table[members], distance_fun, linkage)
+        if len(members) > 1
+        else None
+        for members in groups
+    ]
+    centres = np.array([table[members].mean(axis=0) for members in groups])
+    top = hcluster_linkage(centres, distance_fun, linkage) if len(groups) > 1 else None
+
+    result = _compose(table, groups, parts, top)
+    report = cophenetic_report(
+        table, result, distance_fun, linkage, sample=sample, seed=seed
+    )
+    log.info("approximation: %s", report)
+    return result, report
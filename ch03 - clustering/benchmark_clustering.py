@@ -0,0 +1,241 @@
+""" Benchmarks of the clustering pipeline on synthetic blog data
+
+    Tables shaped like blogdata (word counts of ~700 words, every word present in
+    10 % to 50 % of the blogs) are generated at every size, then
+
+     - distances: condensed_distances
+     - clustering: hcluster_linkage on these distances (approximate_hcluster,
+       without distances, above --exact-limit rows)
+     - rendering: to_tree, write_dendrogram_svg and, up to --png-limit rows,
+       draw_dendrogram
+
+    are timed, then run again under tracemalloc for their peak memory. Results
+    are saved as json, to compare commits:
+
+        python benchmark_clustering.py --output before.json
+        git checkout other-branch
+        python benchmark_clustering.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from approximate_clustering import approximate_hcluster
+from hcluster_algorithms import LINKAGES, condensed_distances, hcluster_linkage
+from hcluster_representation import draw_dendrogram, write_dendrogram_svg
+from metrics import pearson_distance
+
+log = logging.getLogger(__name__)
+
+SIZES = (100, 1000, 5000, 20000)
+WORDS = 706
+
+
+def synthetic_counts(rows: int, words: int = WORDS, *, seed: int = 0) -> np.array:
+    """ (rows x words) sparse word counts, shaped like blogdata
+
+        Every word is present in a fraction of the blogs between 0.1 and 0.5
+        (the bounds of filter_words), with heavy tailed counts scaled by the
+        length of every blog
+    """
+    rng = np.random.default_rng(seed)
+    presence = rng.uniform(0.1, 0.5, words)
+    length = rng.lognormal(0, 0.5, (rows, 1))
+    counts = rng.geometric(1 / (1 + 3 * length), (rows, words))
+    return np.where(rng.random((rows, words)) < presence, counts, 0).astype(np.float64)
+
+
+def measure(fun: Callable, memory: bool) -> Tuple[float, Optional[int], object]:
+    """ seconds and, with memory, peak traced bytes of fun() """
+    if not memory:
+        start = time.perf_counter()
+        result = fun()
+        return time.perf_counter() - start, None, result
+
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = fun()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak, result
+
+
+def run_phases(
+    table: np.array,
+    *,
+    linkage: str,
+    exact_limit: int,
+    png_limit: int,
+    workdir: Path,
+    memory: bool,
+) -> Dict[str, Tuple[float, Optional[int]]]:
+    """ (seconds, peak bytes) of every phase on table """
+    n = len(table)
+    labels = [f"blog {i}" for i in range(n)]
+    results = {}
+
+    if n <= exact_limit:
+        seconds, peak, distances = measure(
+            lambda: condensed_distances(table, pearson_distance), memory
+        )
+        results["distances"] = seconds, peak
+        seconds, peak, linkage_matrix = measure(
+            lambda: hcluster_linkage(
+                table, pearson_distance, linkage, distances=distances
+            ),
+            memory,
+        )
+        del distances
+    else:
+        seconds, peak, (linkage_matrix, _) = measure(
+            lambda: approximate_hcluster(table, pearson_distance, linkage, seed=0),
+            memory,
+        )
+    results["clustering"] = seconds, peak
+
+    def render():
+        root = linkage_matrix.to_tree()
+        write_dendrogram_svg(root, labels, workdir / "dendrogram.svg")
+        if n <= png_limit:
+            draw_dendrogram(root, labels).save(workdir / "dendrogram.png")
+
+    seconds, peak, _ = measure(render, memory)
+    results["rendering"] = seconds, peak
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(
+    sizes: List[int] = SIZES,
+    *,
+    linkage: str = "centroid",
+    repeat: int = 1,
+    exact_limit: int = 5000,
+    png_limit: int = 2000,
+    memory: bool = True,
+) -> Dict:
+    """ Timings (best of repeat) and peak memory of every phase at every size """
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            table = synthetic_counts(rows)
+            options = dict(
+                linkage=linkage,
+                exact_limit=exact_limit,
+                png_limit=png_limit,
+                workdir=Path(tmp),
+            )
+            timings = [
+                run_phases(table, memory=False, **options) for _ in range(repeat)
+            ]
+            run = {
+                "rows": rows,
+                "words": table.shape[1],
+                "exact": rows <= exact_limit,
+                "seconds": {
+                    phase: min(t[phase][0] for t in timings) for phase in timings[0]
+                },
+            }
+            if memory:
+                peaks = run_phases(table, memory=True, **options)
+                run["peak_bytes"] = {phase: peak for phase, (_, peak) in peaks.items()}
+            log.info("%6d rows: %s", rows, run["seconds"])
+            runs.append(run)
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "linkage": linkage,
+        "runs": runs,
+    }
+
+
+def compare(before: Dict, after: Dict) -> List[str]:
+    """ One line per size and phase: seconds before, after and their ratio """
+    previous = {run["rows"]: run for run in before["runs"]}
+    lines = [f"{before['commit']} -> {after['commit']}"]
+    for run in after["runs"]:
+        old = previous.get(run["rows"])
+        if old is None:
+            continue
+        for phase, seconds in run["seconds"].items():
+            if phase in old["seconds"]:
+                was = old["seconds"][phase]
+                lines.append(
+                    f"{run['rows']:6d} {phase:>10s} {was:9.3f} s -> {seconds:9.3f} s"
+                    f" ({seconds / was if was else float('inf'):5.2f}x)"
+                )
+    return lines
+
+
+def cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--linkage", choices=LINKAGES, default="centroid")
+    parser.add_argument("--repeat", type=int, default=1, help="best of REPEAT runs")
+    parser.add_argument(
+        "--exact-limit",
+        type=int,
+        default=5000,
+        help="rows above which approximate_hcluster is used",
+    )
+    parser.add_argument(
+        "--png-limit", type=int, default=2000, help="rows above which no png is drawn"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the tracemalloc runs"
+    )
+    parser.add_argument("--output", type=Path, help="results (.json)")
+    parser.add_argument("--compare", type=Path, help="earlier results (.json)")
+    args = parser.parse_args(argv)
+
+    results = benchmark(
+        args.sizes,
+        linkage=args.linkage,
+        repeat=args.repeat,
+        exact_limit=args.exact_limit,
+        png_limit=args.png_limit,
+        memory=not args.no_memory,
+    )
+    output = args.output or Path(f"benchmark-{results['commit'] or 'local'}.json")
+    with open(output, "wt") as fh:
+        json.dump(results, fh, indent=1)
+    log.info("Results saved to %s", output)
+
+    if args.compare:
+        with open(args.compare, "rt") as fh:
+            print("\n".join(compare(json.load(fh), results)))
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    cli()
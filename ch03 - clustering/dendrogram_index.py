@@ -0,0 +1,184 @@
+""" Flat clusters and lookups over the result of hcluster
+
+    DendrogramIndex walks the tree once: leaves are numbered in drawing order
+    (left to right) so that every subtree is a contiguous range of that order.
+    Then
+
+     - cut(threshold): the largest subtrees whose merges are all <= threshold
+     - cut(k=...): the k clusters left by undoing the k - 1 last merges
+
+    are O(n) array operations, and FlatClusters.cluster_of(leaf) is a binary
+    search over the starts of the ranges. Cuts are cached per index
+
+        index = DendrogramIndex(hcluster_linkage(table), labels=blogs)
+        clusters = index.cut(0.8)
+        clusters.members(clusters.cluster_of("Gothamist"))
+"""
+import bisect
+import logging
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from hcluster_algorithms import BiNode, LinkageMatrix
+
+log = logging.getLogger(__name__)
+
+
+class FlatClusters:
+    """ Partition of the leaves, every cluster a range of the leaf order """
+
+    def __init__(self, index: "DendrogramIndex", roots: np.array):
+        self.index = index
+        order = np.argsort(index.start[roots], kind="stable")
+        self.roots = roots[order]  # node of every cluster
+        self.starts = index.start[self.roots]
+        self.ends = index.end[self.roots]
+
+        self.labels = np.empty(index.n_leaves, dtype=np.int64)
+        sizes = self.ends - self.starts
+        self.labels[index.order] = np.repeat(np.arange(len(self.roots)), sizes)
+        self._starts = self.starts.tolist()
+
+    def __len__(self) -> int:
+        return len(self.roots)
+
+    def cluster_of(self, leaf: Union[int, Hashable]) -> int:
+        """ number of the cluster of a leaf (or of its label), in O(log n) """
+        position = self.index.position[self.index.leaf_id(leaf)]
+        return bisect.bisect_right(self._starts, position) - 1
+
+    def members(self, cluster: int) -> List[int]:
+        """ leaves of a cluster, in drawing order """
+        return self.index.order[self.starts[cluster] : self.ends[cluster]].tolist()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self)} clusters)"
+
+
+class DendrogramIndex:
+    def __init__(self, result: LinkageMatrix, labels: Optional[Sequence] = None):
+        Z = result.Z
+        n = len(Z) + 1
+        self.n_leaves = n
+        self.Z = Z
+        self.labels = labels
+        self._label_ids: Dict[Hashable, int] = (
+            {label: i for i, label in enumerate(labels)} if labels is not None else {}
+        )
+
+        left = Z[:, 0].astype(np.int64)
+        right = Z[:, 1].astype(np.int64)
+
+        # parent of every node, -1 for the root
+        self.parent = np.full(2 * n - 1, -1, dtype=np.int64)
+        self.parent[left] = np.arange(n, 2 * n - 1)
+        self.parent[right] = np.arange(n, 2 * n - 1)
+
+        # largest merge distance in every subtree (monotonic towards the root,
+        # even when the distances of the merges are not)
+        self.height = np.zeros(2 * n - 1)
+        for k, (a, b, distance) in enumerate(zip(left, right, Z[:, 2].tolist())):
+            self.height[n + k] = max(distance, self.height[a], self.height[b])
+
+        # leaves in drawing order and the range of every subtree in it
+        self.order, self.start, self.end = self._layout(left, right)
+        self.position = np.empty(n, dtype=np.int64)
+        self.position[self.order] = np.arange(n)
+
+        # internal nodes from the last merge undone to the first
+        internal = np.arange(n, 2 * n - 1)
+        self._split_order = internal[np.lexsort((-internal, -self.height[internal]))]
+        self._cache: Dict[Tuple, FlatClusters] = {}
+
+    @classmethod
+    def from_tree(
+        cls, root: BiNode, labels: Optional[Sequence] = None
+    ) -> "DendrogramIndex":
+        """ Index of a BiNode tree as returned by hcluster (uids as in to_tree) """
+        merges = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if not node.is_leaf():
+                merges.append(node)
+                stack.extend([node.left, node.right])
+        n = len(merges) + 1
+
+        def node_id(node: BiNode) -> int:
+            return node.uid if node.is_leaf() else n - node.uid - 1
+
+        Z = np.zeros((n - 1, 4))
+        for node in merges:
+            Z[-node.uid - 1, :3] = (
+                node_id(node.left),
+                node_id(node.right),
+                node.distance,
+            )
+        sizes = np.ones(2 * n - 1)
+        for k, (a, b) in enumerate(Z[:, :2].astype(np.int64).tolist()):
+            sizes[n + k] = Z[k, 3] = sizes[a] + sizes[b]
+        return cls(LinkageMatrix(Z, np.empty((0, 0))), labels)
+
+    def _layout(
+        self, left: np.array, right: np.array
+    ) -> Tuple[np.array, np.array, np.array]:
+        n = self.n_leaves
+        order = np.empty(n, dtype=np.int64)
+        start = np.zeros(2 * n - 1, dtype=np.int64)
+        end = np.zeros(2 * n - 1, dtype=np.int64)
+
+        sizes = np.ones(2 * n - 1, dtype=np.int64)
+        for k in range(n - 1):
+            sizes[n + k] = sizes[left[k]] + sizes[right[k]]
+
+        # pre-order: a node starts where its parent (or its left sibling) ends
+        stack = [(2 * n - 2, 0)]
+        while stack:
+            node, first = stack.pop()
+            start[node], end[node] = first, first + sizes[node]
+            if node < n:
+                order[first] = node
+            else:
+                a, b = left[node - n], right[node - n]
+                stack.append((b, first + sizes[a]))
+                stack.append((a, first))
+        return order, start, end
+
+    def leaf_id(self, leaf: Union[int, Hashable]) -> int:
+        if leaf in self._label_ids:
+            return self._label_ids[leaf]
+        return int(leaf)
+
+    def cut(
+        self, threshold: Optional[float] = None, *, k: Optional[int] = None
+    ) -> FlatClusters:
+        """ Flat clusters at a distance threshold, or k of them """
+        if (threshold is None) == (k is None):
+            raise ValueError("Either threshold or k is required")
+        key = ("threshold", threshold) if k is None else ("k", k)
+        if key not in self._cache:
+            if k is None:
+                roots = self._roots_below(threshold)
+            else:
+                roots = self._roots_of_k(k)
+            self._cache[key] = FlatClusters(self, roots)
+        return self._cache[key]
+
+    def _roots_below(self, threshold: float) -> np.array:
+        low = self.height <= threshold
+        parent_low = np.zeros_like(low)
+        has_parent = self.parent >= 0
+        parent_low[has_parent] = low[self.parent[has_parent]]
+        return np.flatnonzero(low & ~parent_low)
+
+    def _roots_of_k(self, k: int) -> np.array:
+        n = self.n_leaves
+        k = max(1, min(k, n))
+        # undoing the k - 1 last merges leaves their children as clusters
+        split = np.zeros(2 * n - 1, dtype=bool)
+        split[self._split_order[: k - 1]] = True
+        if k == 1:
+            return np.array([2 * n - 2])
+        children = self.Z[split[n:], :2].astype(np.int64).ravel()
+        return children[~split[children]]
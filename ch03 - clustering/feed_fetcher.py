@@ -0,0 +1,141 @@
+""" Concurrent download of feeds with HTTP validators
+
+    fetch_feeds downloads a list of urls on a bounded thread pool, with at most
+    per_host requests at a time to the same host and a timeout per request, so a
+    slow host only delays its own feeds.
+
+    FeedCache keeps on disk the ETag / Last-Modified headers of every feed, and
+    only them. They are sent back as If-None-Match / If-Modified-Since and a 304
+    answer means the feed did not change since it was last downloaded: what was
+    extracted from it is up to the caller to keep (see WordCountStore)
+"""
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import attr
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = "generate_feed_vector (+feedlist.txt)"
+
+
+@attr.s(auto_attribs=True)
+class FetchResult:
+    url: str
+    status: Optional[int] = None  # None when the request failed
+    content: Optional[bytes] = None  # None unless status is 200
+    etag: Optional[str] = None
+    modified: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+class FeedCache:
+    """ url -> validators (ETag, Last-Modified), stored in one json file """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path, "rt") as fh:
+                self._entries = json.load(fh)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._entries
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """ conditional request headers for url """
+        entry = self._entries.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("modified"):
+            headers["If-Modified-Since"] = entry["modified"]
+        return headers
+
+    def discard(self, url: str):
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def update(self, result: FetchResult):
+        with self._lock:
+            self._entries[result.url] = {
+                "etag": result.etag,
+                "modified": result.modified,
+            }
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with self._lock, open(tmp, "wt") as fh:
+            json.dump(self._entries, fh)
+        tmp.replace(self.path)
+
+
+def fetch(
+    url: str, *, timeout: float = 10.0, headers: Optional[Dict[str, str]] = None
+) -> FetchResult:
+    request = urllib.request.Request(
+        url, headers={"User-Agent": USER_AGENT, **(headers or {})}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return FetchResult(
+                url,
+                response.status,
+                response.read(),
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+    except urllib.error.HTTPError as err:
+        if err.code == 304:
+            return FetchResult(url, 304)
+        return FetchResult(url, err.code, error=str(err))
+    except Exception as err:  # pylint: disable=broad-except
+        # timeouts, dns and connection errors
+        return FetchResult(url, error=f"{err.__class__.__name__}: {err}")
+
+
+def fetch_feeds(
+    urls: List[str],
+    *,
+    workers: int = 16,
+    per_host: int = 2,
+    timeout: float = 10.0,
+    cache: Optional[FeedCache] = None,
+) -> Dict[str, FetchResult]:
+    """ Downloads urls concurrently, conditionally on the validators in cache """
+    by_host: Dict[str, List[str]] = {}
+    for url in urls:
+        by_host.setdefault(urlsplit(url).netloc, []).append(url)
+    host_limits = {host: threading.Semaphore(per_host) for host in by_host}
+
+    # round robin over the hosts, so that the threads waiting for a busy host
+    # do not hold back the feeds of the others
+    queue = [url for batch in zip_longest(*by_host.values()) for url in batch if url]
+
+    def task(url: str) -> FetchResult:
+        headers = cache.validators(url) if cache is not None else {}
+        with host_limits[urlsplit(url).netloc]:
+            result = fetch(url, timeout=timeout, headers=headers)
+        if result.error:
+            log.error("%s failed: %s", url, result.error)
+        else:
+            log.info("Fetched %s (%d)", url, result.status)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(zip(queue, pool.map(task, queue)))
+    return {url: results[url] for url in urls}
@@ -1,22 +1,31 @@
 import json
 import logging
+import multiprocessing
 import re
 import sys
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import feedparser
+import numpy as np
 from feedparser import FeedParserDict
 
+from feed_fetcher import FeedCache, fetch_feeds
+from wordcount_store import WordCountStore
+
 current_dir = Path(sys.argv[0] if __name__ == "__main__" else __file__).resolve().parent
 data_dir = current_dir / "data"
+feed_cache_path = data_dir / "feed_cache.json"
+store_path = data_dir / "wordcounts.sqlite"
 
 log = logging.getLogger()
 logging.basicConfig(level=logging.INFO)
 
 tag_pattern = re.compile(r"<[^>]+>")
-non_alpha_pattern = re.compile(r"[^A-Z^a-z]+")
+word_pattern = re.compile(r"[A-Z^a-z]+")
 
 
 def zero() -> int:
@@ -35,55 +44,198 @@ def get_feeds() -> List[str]:
 
 def extract_words(html_text: str) -> List[str]:
     txt = tag_pattern.sub("", html_text)  # deletes tags
-    words = non_alpha_pattern.split(txt)  # split by non-alphas
-    return [word.lower() for word in words if word.strip()]
+    words = word_pattern.findall(txt)  # runs of alphas
+    # words are ascii: lowering them at once is the same as one by one
+    return " ".join(words).lower().split()
 
 
-def get_word_counts(url: str) -> Tuple[str, Dict[str, int]]:
-    log.info("Parsing %s", url)
+def count_words_into(counter: Counter, html_text: str) -> Counter:
+    """ Adds the words of html_text (see extract_words) to counter """
+    counter.update(extract_words(html_text))
+    return counter
 
-    data: FeedParserDict = feedparser.parse(url)
 
+def entry_id(entry: FeedParserDict) -> str:
+    return entry.get("id") or entry.get("link") or entry.title
+
+
+def entry_text(entry: FeedParserDict) -> str:
+    summary = entry.summary if "summary" in entry else entry.description
+    return entry.title + " " + summary
+
+
+def entry_words(entry: FeedParserDict) -> List[str]:
+    return extract_words(entry_text(entry))
+
+
+def count_words(data: FeedParserDict) -> Tuple[str, Dict[str, int]]:
     total_wc = Counter()
 
     for entry in data.entries:
-        summary = entry.summary if "summary" in entry else entry.description
-
-        words = extract_words(entry.title + " " + summary)
-        wc = Counter(words)
-        total_wc.update(wc)
+        count_words_into(total_wc, entry_text(entry))
 
     return data.feed.title, total_wc
 
 
-def generate():
-    # word count per blog
-    wc_per_blog: Dict[str, Counter] = {}
-
-    # blog count per word (how many blogs a word appers)
-    apcount = Counter()
+def get_word_counts(url: str) -> Tuple[str, Dict[str, int]]:
+    log.info("Parsing %s", url)
 
-    feeds = {}
+    data: FeedParserDict = feedparser.parse(url)
+    return count_words(data)
+
+
+def tokenise_feed(
+    content: bytes, known: Set[str] = frozenset()
+) -> Tuple[str, List[Tuple[str, Counter]], Set[str]]:
+    """ Title, word counts of the entries of the feed whose id is not in known, and
+        the ids of all its entries
+    """
+    data: FeedParserDict = feedparser.parse(content)
+    entries = []
+    ids = set()
+    for entry in data.entries:
+        eid = entry_id(entry)
+        ids.add(eid)
+        if eid not in known:
+            entries.append((eid, count_words_into(Counter(), entry_text(entry))))
+    return data.feed.title, entries, ids
+
+
+def _tokenise_job(job: Tuple[str, bytes, Set[str]]):
+    url, content, known = job
+    try:
+        return tokenise_feed(content, known)
+    except Exception:  # pylint: disable=broad-except
+        log.error("%s failed", url)
+        return None
+
+
+def _count_job(job: Tuple[str, bytes]):
+    url, content = job
+    try:
+        return count_words(feedparser.parse(content))
+    except Exception:  # pylint: disable=broad-except
+        log.error("%s failed", url)
+        return None
+
+
+def replace_entries(
+    store: WordCountStore,
+    url: str,
+    title: str,
+    entries: List[Tuple[str, Counter]],
+    ids: Set[str],
+) -> int:
+    """ Makes the entries of url in store those of the feed (see tokenise_feed) """
+    store.remove_entries(url, store.known_entries(url) - ids)
+    return store.add_entries(url, title, entries)
+
+
+def update_store(store: WordCountStore, url: str, content: bytes) -> int:
+    """ Tokenises the entries of the feed that are not in store yet, and drops the
+        ones it no longer publishes
+    """
+    known = store.known_entries(url)
+    return replace_entries(store, url, *tokenise_feed(content, known))
+
+
+def generate(
+    *,
+    workers: int = 16,
+    per_host: int = 2,
+    timeout: float = 10.0,
+    incremental: bool = False,
+    processes: Optional[int] = None,
+):
+    """ Fetches the feeds concurrently (see feed_fetcher.fetch_feeds)
+
+        Without incremental, the words of every feed are counted straight into a
+        Counter per blog. With incremental, the word counts of every entry are kept in a
+        WordCountStore: feeds not modified since the last run are not downloaded
+        again and only new entries are tokenised, entries no longer in a feed are
+        dropped. Feeds that fail keep the counts stored by previous runs, with a
+        warning.
+
+        With processes, the downloaded feeds are parsed and tokenised on a pool of
+        that many processes, one feed per task
+    """
     target_feeds = get_feeds()
-
-    log.info("Parsing %d feeds", len(target_feeds))
-    for url in target_feeds:
-        try:
-            blog_name, wc = get_word_counts(url)
-            wc_per_blog[blog_name] = wc
+    store = cache = None
+    if incremental:
+        store = WordCountStore(store_path)
+        cache = FeedCache(feed_cache_path)
+        # a 304 is useless for the feeds the store knows nothing about
+        for url in set(target_feeds) - store.feeds().keys():
+            cache.discard(url)
+
+    log.info("Fetching %d feeds", len(target_feeds))
+    results = fetch_feeds(
+        target_feeds, workers=workers, per_host=per_host, timeout=timeout, cache=cache
+    )
+
+    downloaded = [result for result in results.values() if result.status == 200]
+    if store is not None:
+        job_fun = _tokenise_job
+        jobs = [(r.url, r.content, store.known_entries(r.url)) for r in downloaded]
+    else:
+        # counted straight into one Counter per blog
+        job_fun = _count_job
+        jobs = [(r.url, r.content) for r in downloaded]
+    worked = sum(1 for result in results.values() if result.not_modified)
+
+    log.info("Parsing %d feeds", len(jobs))
+    pool = None
+    if processes:
+        # spawned, not forked: this process runs threads (fetch_feeds)
+        spawn = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(processes, mp_context=spawn)
+
+    updated = {url for url, result in results.items() if result.not_modified}
+    counted: Dict[str, Tuple[str, Counter]] = {}  # url -> title, word counts
+    with pool or nullcontext():
+        parsed_feeds = pool.map(job_fun, jobs) if pool else map(job_fun, jobs)
+        for result, parsed in zip(downloaded, parsed_feeds):
+            if parsed is None:
+                continue
+            if store is not None:
+                replace_entries(store, result.url, *parsed)
+                cache.update(result)
+            else:
+                counted[result.url] = parsed
+            updated.add(result.url)
+            worked += 1
+
+    log.info("%3.1f %% of feeds worked", worked / len(target_feeds) * 100)
+
+    if store is None:
+        feeds = {counted[url][0]: url for url in target_feeds if url in counted}
+        wc_per_blog = {blog: counted[url][1] for blog, url in feeds.items()}
+        apcount = Counter()
+        for _, wc in counted.values():
             apcount.update(wc.keys())
-            feeds[blog_name] = url
-        except Exception:  # pylint: disable=broad-except
-            log.error("%s failed", url)
+        return feeds, wc_per_blog, apcount
 
-    log.info("%3.1f %% of feeds worked", len(feeds) / len(target_feeds))
+    cache.save()
+
+    stored = store.feeds()
+    feeds = {stored[url]: url for url in target_feeds if url in stored}
+    for url in feeds.values():
+        if url not in updated:
+            log.warning("%s failed, using the counts of a previous run", url)
+
+    # word count per blog
+    wc_per_blog: Dict[str, Counter] = {
+        blog: store.word_counts(url) for blog, url in feeds.items()
+    }
+
+    # blog count per word (how many blogs a word appers)
+    apcount = store.apcount(exclude=stored.keys() - set(feeds.values()))
 
+    store.close()
     return feeds, wc_per_blog, apcount
 
 
-def filter_and_pack(
-    feeds: Dict[str, str], wc_per_blog: Dict[str, Counter], apcount: Counter
-):
+def filter_words(wc_per_blog: Dict[str, Counter], apcount: Counter) -> List[str]:
     blog_count = len(wc_per_blog)
 
     log.info("Filtering word list")
@@ -96,6 +248,13 @@ def filter_and_pack(
             wordlist.append(word)
 
     log.info("%3.2f %% of words kept", len(wordlist) / len(apcount) * 100)
+    return wordlist
+
+
+def filter_and_pack(
+    feeds: Dict[str, str], wc_per_blog: Dict[str, Counter], apcount: Counter
+):
+    wordlist = filter_words(wc_per_blog, apcount)
 
     log.info("Packing into json ...")
     data = {
@@ -112,20 +271,126 @@ def filter_and_pack(
     return data
 
 
+def pack_matrix(
+    feeds: Dict[str, str], wc_per_blog: Dict[str, Counter], wordlist: List[str]
+) -> Dict[str, np.array]:
+    """ Arrays of blogdata.npz: the (blogs x words) counts in CSR form
+
+        Row i holds counts[indptr[i]:indptr[i + 1]] at columns
+        indices[indptr[i]:indptr[i + 1]], the ids of the words in wordlist
+    """
+    word_ids = {word: j for j, word in enumerate(wordlist)}
+    indptr, indices, counts = [0], [], []
+    for wc in wc_per_blog.values():
+        row = sorted((word_ids[w], c) for w, c in wc.items() if w in word_ids and c)
+        indices.extend(j for j, _ in row)
+        counts.extend(c for _, c in row)
+        indptr.append(len(indices))
+
+    return {
+        "indptr": np.array(indptr, dtype=np.int64),
+        "indices": np.array(indices, dtype=np.int32),
+        "counts": np.array(counts, dtype=np.int32),
+        "words": np.array(wordlist, dtype=str),
+        "blogs": np.array(list(wc_per_blog), dtype=str),
+        "urls": np.array([feeds[blog] for blog in wc_per_blog], dtype=str),
+    }
+
+
+def save_matrix(arrays: Dict[str, np.array], path: Optional[Path] = None):
+    path = path or data_dir / "blogdata.npz"
+    with open(path, "wb") as fh:
+        np.savez(fh, **arrays)
+
+
+def _arrays_from_json(data: Dict) -> Dict[str, np.array]:
+    blogs = data["blogs"]
+    dense = np.array([blog["wc"] for blog in blogs], dtype=np.int32)
+    dense = dense.reshape(len(blogs), len(data["words"]))
+    rows, cols = np.nonzero(dense)
+    return {
+        "indptr": np.concatenate(
+            [[0], np.cumsum(np.bincount(rows, minlength=len(blogs)))]
+        ),
+        "indices": cols.astype(np.int32),
+        "counts": dense[rows, cols],
+        "words": np.array(data["words"], dtype=str),
+        "blogs": np.array([blog["name"] for blog in blogs], dtype=str),
+        "urls": np.array([blog["url"] for blog in blogs], dtype=str),
+    }
+
+
+def load_arrays(path: Optional[Path] = None) -> Dict[str, np.array]:
+    """ Arrays of blogdata.npz
+
+        Converted from blogdata.json instead if there is no npz, or if the json
+        (the dvc tracked data) is newer, e.g. after a dvc pull
+    """
+    path = path or data_dir / "blogdata.npz"
+    if not path.exists():
+        return _arrays_from_json(load_data())
+    json_path = data_dir / "blogdata.json"
+    if json_path.exists() and json_path.stat().st_mtime > path.stat().st_mtime:
+        log.warning("%s is older than %s, converting the json", path, json_path)
+        return _arrays_from_json(load_data())
+    with np.load(path, allow_pickle=False) as npz:
+        return dict(npz)
+
+
+def load_matrix(
+    path: Optional[Path] = None, *, sparse: bool = False, dtype=np.float64
+) -> Tuple[Any, List[str], List[str]]:
+    """ (blogs x words) counts, blog names and words
+
+        The matrix is a numpy array, or a scipy.sparse.csr_matrix with sparse
+        (scipy is then required)
+    """
+    arrays = load_arrays(path)
+    blogs, words = arrays["blogs"].tolist(), arrays["words"].tolist()
+    indptr, indices = arrays["indptr"], arrays["indices"]
+    counts = arrays["counts"].astype(dtype)
+    shape = (len(blogs), len(words))
+
+    if sparse:
+        from scipy.sparse import csr_matrix  # pylint: disable=import-outside-toplevel
+
+        return csr_matrix((counts, indices, indptr), shape=shape), blogs, words
+
+    matrix = np.zeros(shape, dtype=dtype)
+    rows = np.repeat(np.arange(len(blogs)), np.diff(indptr))
+    matrix[rows, indices] = counts
+    return matrix, blogs, words
+
+
 def load_data() -> Dict:
     with open(data_dir / "blogdata.json", "rt") as fh:
         data = json.load(fh)
     return data
 
 
-def main():
-    feeds, wc_per_blog, apcount = generate()
+def convert_json(path: Optional[Path] = None):
+    """ Writes blogdata.npz from blogdata.json """
+    save_matrix(_arrays_from_json(load_data()), path)
+
+
+def main(export_json: bool = True, incremental: bool = False):
+    feeds, wc_per_blog, apcount = generate(incremental=incremental)
 
-    data = filter_and_pack(feeds, wc_per_blog, apcount)
+    if export_json:
+        data = filter_and_pack(feeds, wc_per_blog, apcount)
+        with open(data_dir / "blogdata.json", "wt") as fh:
+            json.dump(data, fh, indent=1)
 
-    with open(data_dir / "blogdata.json", "wt") as fh:
-        json.dump(data, fh, indent=1)
+    # after the json: an older npz is taken as stale by load_arrays
+    wordlist = filter_words(wc_per_blog, apcount)
+    save_matrix(pack_matrix(feeds, wc_per_blog, wordlist))
 
 
 if __name__ == "__main__":
-    main()
+    if "--from-json" in sys.argv[1:]:
+        convert_json()
+    else:
+        main(
+            export_json="--no-json" not in sys.argv[1:],
+            incremental="--incremental" in sys.argv[1:],
+        )
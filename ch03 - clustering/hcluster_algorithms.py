@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 import logging
-import random
-from typing import Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
 
 import attr
 import numpy as np
 
-from metrics import pearson_distance
+from metrics import (
+    MAX_MEMORY,
+    eucledian_distance,
+    pairwise_euclidean,
+    pairwise_pearson,
+    pearson_distance,
+)
 
 # SEE https://www.python.org/dev/peps/pep-0563/
 
@@ -19,7 +25,8 @@ log = logging.getLogger(__name__)
 @attr.s(auto_attribs=True, frozen=True)
 class BiNode:
     uid: int
-    vec: np.array = attr.ib(converter=np.array)
+    # a view, not a copy, when given an array (e.g. a row of LinkageMatrix.centroids)
+    vec: np.array = attr.ib(converter=np.asarray)
 
     # binary tree children
     left: Optional[BiNode] = None
@@ -34,71 +41,404 @@ class BiNode:
         return self.uid >= 0
 
 
-def hcluster(table: List[List[Any]], distance_fun=pearson_distance) -> BiNode:
+LINKAGES = ("centroid", "average", "complete", "single")
 
-    cached_distance = {}
+# (left, right, distance) where ids < n are rows of the table and n + k is the
+# cluster formed at step k (same convention as scipy's linkage matrix)
+Merge = Tuple[int, int, float]
 
-    def get_distance(src: BiNode, dst: BiNode) -> float:
-        nonlocal cached_distance
-        # simple cache commutative
-        key = tuple(sorted([src.uid, dst.uid]))
-        try:
-            result = cached_distance[key]
-        except KeyError:
-            result = distance_fun(src.vec, dst.vec)
-            cached_distance[key] = result
-        return result
 
-    # original nodes identified with positive uids
-    items: List[BiNode] = [BiNode(i, row[:]) for i, row in enumerate(table)]
+def condensed_index(n: int, i: int, j: int) -> int:
+    """ position of pair (i, j), i < j, in a condensed distance array of n items """
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
 
-    cluster_counter: int = 0
-    while len(items) > 1:
-        i0, j0 = 0, 1
-        dmin = get_distance(items[i0], items[j0])
 
-        for i, src in enumerate(items):
-            for j, dst in enumerate(items[i + 1 :], start=i + 1):
-                dij = get_distance(src, dst)
-                if dij < dmin:
-                    i0, j0, dmin = i, j, dij
+def _row_positions(n: int, x: int) -> np.array:
+    """ positions in a condensed array of the pairs (x, k) for every k (k == x is 0) """
+    k = np.arange(n)
+    lower = n * k - k * (k + 1) // 2 + (x - k - 1)
+    upper = n * x - x * (x + 1) // 2 + (k - x - 1)
+    positions = np.where(k < x, lower, upper)
+    positions[x] = 0
+    return positions
 
-        # cluster identified with negavite uid
-        cluster_counter += 1
-        cluster = BiNode.from_nodes(
-            uid=-cluster_counter, left=items[i0], right=items[j0], distance=dmin,
+
+# batched version of the distance functions, fun(X, Y) -> (len(X), len(Y)) distances
+PAIRWISE = {pearson_distance: pairwise_pearson, eucledian_distance: pairwise_euclidean}
+
+
+def distances_to(distance_fun, vec: np.array, vecs: np.array) -> np.array:
+    """ distance_fun(vec, v) for every v in vecs """
+    pairwise = PAIRWISE.get(distance_fun)
+    if pairwise is not None:
+        return pairwise(vec[np.newaxis], vecs)[0]
+    return np.array([distance_fun(vec, v) for v in vecs], dtype=float)
+
+
+def condensed_distances(
+    vecs: np.array,
+    distance_fun=pearson_distance,
+    *,
+    max_memory: int = MAX_MEMORY,
+    workers: Optional[int] = None,
+    dtype=np.float64,
+) -> np.array:
+    """ distance_fun between every pair of rows, in a condensed array
+
+        With a batched kernel (see PAIRWISE) rows are computed in blocks, on
+        `workers` threads when given (numpy releases the GIL)
+    """
+    n = len(vecs)
+    dist = np.empty(n * (n - 1) // 2, dtype=dtype)
+    pairwise = PAIRWISE.get(distance_fun)
+    if pairwise is None:
+        pos = 0
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                dist[pos] = distance_fun(vecs[i], vecs[j])
+                pos += 1
+        return dist
+
+    def fill(start: int, stop: int):
+        block = pairwise(vecs[start:stop], vecs[start:], max_memory=max_memory)
+        for i in range(start, stop):
+            pos = condensed_index(n, i, i + 1)
+            dist[pos : pos + n - i - 1] = block[i - start, i - start + 1 :]
+
+    step = max(1, max_memory // (8 * max(n, 1)))
+    if workers:
+        # smaller blocks, so that the threads get a balanced share of rows
+        step = max(1, min(step, n // (4 * workers)))
+    blocks = [(start, min(start + step, n - 1)) for start in range(0, n - 1, step)]
+
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda block: fill(*block), blocks))
+    else:
+        for start, stop in blocks:
+            fill(start, stop)
+    return dist
+
+
+def _nn_chain_merges(dist: np.array, n: int, linkage: str) -> List[Merge]:
+    """ Nearest-neighbour chain over a condensed array (modified in place)
+
+        Valid for reducible linkages, where merging two clusters never brings
+        the result closer to a third one than they were. Merges are returned in
+        chain order and refer to the slot of the clusters: slot y holds x + y
+    """
+    active = np.ones(n, dtype=bool)
+    size = np.ones(n)
+    merges = []
+    chain: List[int] = []
+
+    while len(merges) < n - 1:
+        if not chain:
+            chain.append(int(np.argmax(active)))
+
+        while True:
+            x = chain[-1]
+            positions = _row_positions(n, x)
+            row = dist[positions]
+            row[~active] = np.inf
+            row[x] = np.inf
+
+            y = int(np.argmin(row))
+            # on ties, prefer the previous element so the chain terminates
+            if len(chain) > 1 and row[chain[-2]] <= row[y]:
+                y = chain[-2]
+                break
+            chain.append(y)
+
+        chain.pop()
+        chain.pop()
+        d = row[y]
+        merges.append((x, y, d))
+
+        # Lance-Williams update of the distances to the new cluster, kept in slot y
+        others = active.copy()
+        others[[x, y]] = False
+        dx = row[others]
+        dy = dist[_row_positions(n, y)][others]
+        if linkage == "single":
+            updated = np.minimum(dx, dy)
+        elif linkage == "complete":
+            updated = np.maximum(dx, dy)
+        else:  # average
+            updated = (size[x] * dx + size[y] * dy) / (size[x] + size[y])
+        dist[_row_positions(n, y)[others]] = updated
+
+        active[x] = False
+        size[y] += size[x]
+
+    return merges
+
+
+def _label(merges: List[Merge], n: int) -> List[Merge]:
+    """ Sorts merges by distance and relabels slots into cluster ids """
+    parent = np.arange(2 * n - 1)
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    labelled = []
+    for k, (x, y, d) in enumerate(sorted(merges, key=lambda m: m[2])):
+        a, b = find(x), find(y)
+        labelled.append((min(a, b), max(a, b), d))
+        parent[a] = parent[b] = n + k
+    return labelled
+
+
+def _centroid_merges(
+    centroids: np.array, dist: np.array, distance_fun=pearson_distance
+) -> List[Merge]:
+    """ Merges the two closest clusters, whose vec is the mean of their two vecs
+
+        Centroid distances are not reducible, so instead of a chain every active
+        cluster keeps its nearest neighbour. After a merge only the clusters whose
+        neighbour was merged are rescanned, which is O(n) each.
+        The vec of cluster n + k is written in centroids[n + k]
+    """
+    n = (len(centroids) + 1) // 2
+    active = np.ones(n, dtype=bool)
+    ids = np.arange(n)  # cluster id held by every slot
+
+    nearest = np.zeros(n, dtype=int)
+    nearest_dist = np.full(n, np.inf)
+
+    def rescan(i: int):
+        row = dist[_row_positions(n, i)]
+        row[~active] = np.inf
+        row[i] = np.inf
+        nearest[i] = np.argmin(row)
+        nearest_dist[i] = row[nearest[i]]
+
+    for i in range(n):
+        rescan(i)
+
+    merges = []
+    for k in range(n - 1):
+        i = int(np.argmin(nearest_dist))
+        j = int(nearest[i])
+        a, b = sorted((int(ids[i]), int(ids[j])))
+        merges.append((a, b, nearest_dist[i]))
+
+        # the new cluster takes slot i
+        active[j] = False
+        nearest_dist[j] = np.inf
+        centroids[n + k] = 0.5 * (centroids[a] + centroids[b])
+        ids[i] = n + k
+
+        others = np.flatnonzero(active)
+        others = others[others != i]
+        new_dist = distances_to(distance_fun, centroids[n + k], centroids[ids[others]])
+        dist[_row_positions(n, i)[others]] = new_dist
+
+        rescan(i)
+        for o, d in zip(others.tolist(), new_dist.tolist()):
+            if d < nearest_dist[o]:
+                nearest[o], nearest_dist[o] = i, d
+            elif nearest[o] in (i, j):
+                rescan(o)
+
+    return merges
+
+
+class LinkageMatrix:
+    """ Result of hcluster_linkage, one row per merge
+
+        Z[k] = (left, right, distance, size) is cluster n + k, where ids < n are
+        rows of the table (the layout of scipy's linkage matrix). centroids[id] is
+        the vec of a row or of a cluster, the mean of the vecs of its children
+    """
+
+    def __init__(self, Z: np.array, centroids: np.array):
+        self.Z = Z
+        self.centroids = centroids
+        self._tree: Optional[BiNode] = None
+
+    @property
+    def n_leaves(self) -> int:
+        return len(self.Z) + 1
+
+    def __len__(self) -> int:
+        return len(self.Z)
+
+    def to_tree(self) -> BiNode:
+        """ BiNode view, built on first use: clusters get uid -(k + 1) """
+        if self._tree is None:
+            n = self.n_leaves
+            nodes = [BiNode(i, self.centroids[i]) for i in range(n)]
+            for k, (left, right, distance, _) in enumerate(self.Z.tolist()):
+                nodes.append(
+                    BiNode(
+                        -(k + 1),
+                        self.centroids[n + k],
+                        nodes[int(left)],
+                        nodes[int(right)],
+                        distance,
+                    )
+                )
+            self._tree = nodes[-1]
+        return self._tree
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(n_leaves={self.n_leaves})"
+
+
+def hcluster_linkage(
+    table: List[List[Any]],
+    distance_fun=pearson_distance,
+    linkage: str = "centroid",
+    *,
+    distances: Optional[np.array] = None,
+    workers: Optional[int] = None,
+    dtype=np.float64,
+) -> LinkageMatrix:
+    """ Agglomerative clustering of the rows of table
+
+        linkage sets the distance between two clusters:
+         - centroid: distance_fun between their vecs (the mean of their children)
+         - average, complete, single: mean, max or min distance_fun between their rows
+
+        distances: condensed_distances of table when already computed (it is
+        overwritten), otherwise computed on `workers` threads in `dtype`
+    """
+    if linkage not in LINKAGES:
+        raise ValueError(f"Unknown linkage {linkage}, expected one of {LINKAGES}")
+
+    table = np.asarray(table, dtype=float)
+    n = len(table)
+    if n == 0:
+        return None
+
+    # rows then clusters
+    centroids = np.empty((2 * n - 1,) + table.shape[1:])
+    centroids[:n] = table
+    if n == 1:
+        # nothing to merge: to_tree() is the single leaf
+        return LinkageMatrix(np.zeros((0, 4)), centroids)
+    if distances is None:
+        distances = condensed_distances(
+            centroids[:n], distance_fun, workers=workers, dtype=dtype
         )
-        del items[j0]  # first largest
-        del items[i0]
-        items.append(cluster)
+    dist = distances
+
+    if linkage == "centroid":
+        merges = _centroid_merges(centroids, dist, distance_fun)
+    else:
+        merges = _label(_nn_chain_merges(dist, n, linkage), n)
+        for k, (left, right, _) in enumerate(merges):
+            centroids[n + k] = 0.5 * (centroids[left] + centroids[right])
+    del dist, distances
+
+    Z = np.zeros((n - 1, 4))
+    sizes = np.ones(2 * n - 1)
+    for k, (left, right, distance) in enumerate(merges):
+        sizes[n + k] = sizes[left] + sizes[right]
+        Z[k] = left, right, distance, sizes[n + k]
+
+    return LinkageMatrix(Z, centroids)
+
+
+def hcluster(
+    table: List[List[Any]], distance_fun=pearson_distance, linkage: str = "centroid"
+) -> BiNode:
+    """ hcluster_linkage as a BiNode tree """
+    result = hcluster_linkage(table, distance_fun, linkage)
+    return result.to_tree() if result is not None else None
 
-    return items[0] if items else None
 
+def distance_matrix(vecs: np.array, distance_fun=pearson_distance) -> np.array:
+    """ Square (n x n) version of condensed_distances """
+    vecs = np.asarray(vecs, dtype=float)
+    pairwise = PAIRWISE.get(distance_fun)
+    if pairwise is not None:
+        matrix = pairwise(vecs)
+        np.fill_diagonal(matrix, 0)
+        # blocks are computed independently, make it exactly symmetric
+        return 0.5 * (matrix + matrix.T)
 
-def scaledown(data, distance_fun=pearson_distance):
+    n = len(vecs)
+    matrix = np.zeros((n, n))
+    matrix[np.triu_indices(n, 1)] = condensed_distances(vecs, distance_fun)
+    return matrix + matrix.T
+
+
+def classical_mds(distances: np.array, dims: int = 2) -> np.array:
+    """ Torgerson scaling: top eigenvectors of the double-centred squared distances """
+    n = len(distances)
+    centring = np.eye(n) - 1.0 / n
+    gram = -0.5 * centring @ (distances ** 2) @ centring
+    values, vectors = np.linalg.eigh(gram)
+    top = np.argsort(values)[::-1][:dims]
+    return vectors[:, top] * np.sqrt(np.clip(values[top], 0, None))
+
+
+def scaledown(
+    data,
+    distance_fun=pearson_distance,
+    *,
+    rate: float = 0.01,
+    iterations: int = 1000,
+    tol: float = 1e-4,
+    init: str = "classical",
+    seed: Optional[int] = None,
+) -> np.array:
     """
         multidimensional scaling: representing n-dimensional space
-        in a 2d plane 
+        in a 2d plane, returns the (n x 2) points
+
+        Starts from classical MDS (init="classical") or random points
+        (init="random"), then moves all the points along the gradient of the
+        squared error between their 2d distances and the real ones, relative to
+        the real ones. The step grows while the error decreases and is halved
+        when it would increase it. Stops when the error improves by less than tol
+        (relative)
     """
-    items = [np.array(row[:]) for row in data]
-    N = len(items)
+    real = distance_matrix(data, distance_fun)
+    n = len(real)
 
-    distance = [[0.0 for i in range(N)] for j in range(N)]
+    if init == "classical":
+        points = classical_mds(real)
+    elif init == "random":
+        points = np.random.default_rng(seed).random((n, 2))
+    else:
+        raise ValueError(f"Unknown init {init}, expected classical or random")
 
-    for i, src in enumerate(items):
-        for j, dst in enumerate(items[i + 1 :], start=i + 1):
-            distance[i][j] = distance[j][i] = distance_fun(src, dst)
+    # 1 / real, 0 where the real distance is 0 (the pair does not count)
+    inv_real = np.divide(1.0, real, out=np.zeros_like(real), where=real > 0)
 
-    # set n random 2D points
-    points = [np.array([random.random(), random.random()]) for i in range(N)]
+    def relative_error(points: np.array) -> Tuple[float, np.array]:
+        dx = points[:, 0, np.newaxis] - points[:, 0]
+        dy = points[:, 1, np.newaxis] - points[:, 1]
+        fake = np.sqrt(dx * dx + dy * dy)
+        error = (fake - real) * inv_real
+        # sum over the pairs of (fake - real)² / 2 real, whose gradient is used below
+        total = (error * error * real).sum() / 4
+        return total, np.divide(error, fake, out=np.zeros_like(fake), where=fake > 0)
 
+    total_error, weights = relative_error(points)
     count = 0
-    while count < 100:
-        for i, p0 in enumerate(points):
-            grad = np.zeros((1, 2))
-            for j, p1 in enumerate(points[i + 1 :], start=i + 1):
-                errorij = distance_fun(p0, p1) - distance[i][j]
-                grad += (p0 - p1) / distance[i][j] * errorij
-            points[i] += grad
-
-    count += 1
+    for count in range(iterations):
+        # sum over j of weights[i, j] * (point i - point j)
+        grad = weights.sum(axis=1)[:, np.newaxis] * points - weights @ points
+        moved = points - rate * grad
+
+        moved_error, moved_weights = relative_error(moved)
+        if moved_error > total_error:
+            # overshoot: retry from the same points with a smaller step
+            rate *= 0.5
+            continue
+
+        improvement = total_error - moved_error
+        points, total_error, weights = moved, moved_error, moved_weights
+        rate *= 1.2
+        if improvement <= tol * total_error:
+            break
+
+    log.debug("scaledown: %d steps, error %f", count + 1, total_error)
+    return points
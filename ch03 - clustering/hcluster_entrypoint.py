@@ -1,35 +1,175 @@
+""" Hierarchical clustering of the blogs (or of their words, with --revert)
+
+    python hcluster_entrypoint.py [--revert] [--metric pearson] [--linkage centroid]
+        [--workers 4] [--processes 4] [--dtype float32] [--output linkage.npy]
+        [--dendrogram tree.svg] [--approximate 100] [--quiet] [--profile]
+"""
+import argparse
 import logging
-import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
 
 import numpy as np
 
-from generate_feed_vector import load_data
-from hcluster_algorithms import hcluster
-from hcluster_representation import print_cluster
+from approximate_clustering import approximate_hcluster
+from generate_feed_vector import load_matrix
+from hcluster_algorithms import LINKAGES, condensed_distances, hcluster_linkage
+from hcluster_representation import draw_dendrogram, print_cluster, write_dendrogram_svg
+from metrics import eucledian_distance, pearson_distance
+from parallel_distances import log_progress, parallel_condensed_distances
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+METRICS = {"pearson": pearson_distance, "euclidean": eucledian_distance}
+
+
+@contextmanager
+def timed(timings: Dict[str, float], phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def compute_distances(table, distance_fun, workers, processes, dtype) -> np.array:
+    if processes:
+        return parallel_condensed_distances(
+            table, distance_fun, workers=processes, dtype=dtype, progress=log_progress()
+        )
+    return condensed_distances(table, distance_fun, workers=workers, dtype=dtype)
+
+
+def main(
+    revert: bool = False,
+    verbose: bool = True,
+    *,
+    metric: str = "pearson",
+    linkage: str = "centroid",
+    workers: Optional[int] = None,
+    processes: Optional[int] = None,
+    dtype: str = "float64",
+    output: Optional[Path] = None,
+    dendrogram: Optional[Path] = None,
+    profile: bool = False,
+    approximate: Optional[int] = None,
+):
+    """ Returns the root BiNode and the labels of the leaves
+
+        processes: computes the distances in tiles on that many processes
+        output: saves the linkage matrix (LinkageMatrix.Z) as .npy
+        dendrogram: draws the tree, as svg or as an image (png, ...)
+        profile: logs the time spent in every phase
+        approximate: clusters approximately through that many k-means groups,
+            without the full distance matrix (see approximate_clustering)
+    """
+    timings: Dict[str, float] = {}
 
-def main(revert: bool = False, verbose: bool = True):
-    data = load_data()
-    words = data["words"]
-    blogs = [blog["name"] for blog in data["blogs"]]
-    table = np.array([blog["wc"] for blog in data["blogs"]])
+    with timed(timings, "loading"):
+        table, blogs, words = load_matrix()
 
     log.info(" # words: %3d", len(words))
     log.info(" # blogs: %3d", len(blogs))
 
-    labels = blogs
+    labels: List[str] = blogs
     if revert:
-        table = table.T
+        table = np.ascontiguousarray(table.T)
         labels = words
+    if not len(labels):
+        raise ValueError(f"no {'words' if revert else 'blogs'} to cluster")
+
+    distance_fun = METRICS[metric]
+    if approximate:
+        with timed(timings, "merging"):
+            result, _ = approximate_hcluster(
+                table, distance_fun, linkage, n_clusters=approximate
+            )
+    else:
+        with timed(timings, "distances"):
+            distances = compute_distances(
+                table, distance_fun, workers, processes, np.dtype(dtype)
+            )
+        with timed(timings, "merging"):
+            result = hcluster_linkage(table, distance_fun, linkage, distances=distances)
+        del distances
+
+    if output:
+        np.save(output, result.Z)
+        log.info("Linkage matrix saved to %s", output)
+
+    with timed(timings, "rendering"):
+        root = result.to_tree()
+        if verbose:
+            print_cluster(root, labels)
+        if dendrogram:
+            if Path(dendrogram).suffix.lower() == ".svg":
+                write_dendrogram_svg(root, labels, dendrogram)
+            else:
+                draw_dendrogram(root, labels).save(dendrogram)
+            log.info("Dendrogram saved to %s", dendrogram)
+
+    if profile:
+        total = sum(timings.values())
+        for phase, seconds in timings.items():
+            log.info("%10s %8.3f s %5.1f %%", phase, seconds, 100 * seconds / total)
+        log.info("%10s %8.3f s", "total", total)
 
-    root = hcluster(table)
-    if verbose:
-        print_cluster(root, labels)
     return root, labels
 
 
+def cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--revert", action="store_true", help="cluster the words instead of the blogs"
+    )
+    parser.add_argument("--metric", choices=sorted(METRICS), default="pearson")
+    parser.add_argument("--linkage", choices=LINKAGES, default="centroid")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="threads computing the distances"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="processes computing the distances (shared memory tiles)",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=["float64", "float32"],
+        default="float64",
+        help="of the distance matrix, float32 halves its memory",
+    )
+    parser.add_argument("--output", type=Path, help="linkage matrix (.npy)")
+    parser.add_argument(
+        "--dendrogram", type=Path, help="picture of the tree (.svg, .png)"
+    )
+    parser.add_argument(
+        "--approximate",
+        type=int,
+        metavar="GROUPS",
+        help="approximate clustering through GROUPS k-means groups",
+    )
+    parser.add_argument("--quiet", action="store_true", help="do not print the tree")
+    parser.add_argument("--profile", action="store_true", help="time every phase")
+    args = parser.parse_args(argv)
+
+    return main(
+        args.revert,
+        not args.quiet,
+        metric=args.metric,
+        linkage=args.linkage,
+        workers=args.workers,
+        processes=args.processes,
+        dtype=args.dtype,
+        output=args.output,
+        dendrogram=args.dendrogram,
+        profile=args.profile,
+        approximate=args.approximate,
+    )
+
+
 if __name__ == "__main__":
-    main(revert=len(sys.argv) > 1)
+    cli()
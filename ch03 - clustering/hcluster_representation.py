@@ -1,7 +1,10 @@
 import logging
-from typing import List
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+from xml.sax.saxutils import escape
 
-from hcluster_algorithms import BiNode
+from hcluster_algorithms import BiNode, LinkageMatrix
 from PIL import Image, ImageDraw, ImageFont
 
 logging.basicConfig(level=logging.INFO)
@@ -11,32 +14,77 @@ WHITE = (255,) * 3
 RED = (255, 0, 0)
 BLACK = (0,) * 3
 
+ROW_HEIGHT = 20
+WIDTH = 1200
 
-def print_cluster(node: BiNode, labels: List[str], deep: int = 0):
-    indent = " " * deep
-    if not node.is_leaf():
-        print(indent, "+", f"[{node.distance:3.2f}]")
-        print_cluster(node.left, labels, deep + 1)
-        print_cluster(node.right, labels, deep + 1)
-    else:
-        print(indent, labels[node.uid], deep + 1)
 
+def _as_tree(node: Union[BiNode, LinkageMatrix]) -> BiNode:
+    if isinstance(node, LinkageMatrix):
+        return node.to_tree()
+    return node
 
-def draw_dendrogram(root: BiNode, labels=List[str]):
-    def get_height(node: BiNode) -> int:
-        if not node.left and not node.right:
-            return 1
-        return get_height(node.left) + get_height(node.right)
 
-    def get_depth(node: BiNode) -> int:
-        if not node.left and not node.right:
-            return 0
-        return node.distance + max(get_depth(node.left), get_depth(node.right))
+def print_cluster(node: Union[BiNode, LinkageMatrix], labels: List[str], deep: int = 0):
+    # explicit stack: chains of thousands of merges exceed the recursion limit
+    stack = [(_as_tree(node), deep)]
+    while stack:
+        node, deep = stack.pop()
+        indent = " " * deep
+        if not node.is_leaf():
+            print(indent, "+", f"[{node.distance:3.2f}]")
+            stack.append((node.right, deep + 1))
+            stack.append((node.left, deep + 1))
+        else:
+            print(indent, labels[node.uid], deep + 1)
+
+
+def _is_leaf(node: BiNode) -> bool:
+    return not node.left and not node.right
+
+
+def layout(root: BiNode) -> Tuple[Dict[int, int], Dict[int, float]]:
+    """ Height (number of leaves) and depth (longest sum of distances down to a
+        leaf) of every subtree, keyed by id(node), in one post-order pass
+    """
+    heights: Dict[int, int] = {}
+    depths: Dict[int, float] = {}
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if _is_leaf(node):
+            heights[id(node)], depths[id(node)] = 1, 0
+        elif children_done:
+            left, right = id(node.left), id(node.right)
+            heights[id(node)] = heights[left] + heights[right]
+            depths[id(node)] = node.distance + max(depths[left], depths[right])
+        else:
+            stack.extend([(node, True), (node.right, False), (node.left, False)])
+    return heights, depths
+
+
+def dendrogram_shapes(
+    root: BiNode, width: int = WIDTH
+) -> Iterator[Tuple[str, Tuple[float, ...], int]]:
+    """ Size of the picture, then its lines and leaf labels, in drawing order:
+
+        ("size", (w, h), 0), ("line", (x1, y1, x2, y2), 0), ("label", (x, y), uid)
+    """
+    heights, depths = layout(root)
+    h = heights[id(root)] * ROW_HEIGHT
+    depth = depths[id(root)]
+
+    # so it fits in width
+    scaling = float(width - 150) / depth if depth else 0.0
+
+    yield "size", (width, h), 0
+    yield "line", (0, h / 2, 10, h / 2), 0
 
-    def draw_node(node, x, y, scaling, labels, draw) -> None:
+    stack = [(root, 10.0, h / 2)]
+    while stack:
+        node, x, y = stack.pop()
         if node.uid < 0:
-            h1 = get_height(node.left) * 20
-            h2 = get_height(node.right) * 20
+            h1 = heights[id(node.left)] * ROW_HEIGHT
+            h2 = heights[id(node.right)] * ROW_HEIGHT
 
             top = y - (h1 + h2) / 2
             bottom = y + (h1 + h2) / 2
@@ -47,37 +95,82 @@ def draw_dendrogram(root: BiNode, labels=List[str]):
             y2 = bottom - h2 / 2
 
             # vertical
-            draw.line((x, y1, x, y2), fill=RED)
+            yield "line", (x, y1, x, y2), 0
 
             # horizonal for for left
-            draw.line((x, y1, x + ll, y1), fill=RED)
+            yield "line", (x, y1, x + ll, y1), 0
 
             # horizontal line for right
-            draw.line((x, y2, x + ll, y2), fill=RED)
+            yield "line", (x, y2, x + ll, y2), 0
 
-            draw_node(node.left, x + ll, y1, scaling, labels, draw)
-            draw_node(node.right, x + ll, y2, scaling, labels, draw)
+            stack.append((node.right, x + ll, y2))
+            stack.append((node.left, x + ll, y1))
         else:
-            font = ImageFont.truetype("Arial")
-            args = [(x + 5, y - 7), labels[node.uid], BLACK]
-            try:
-                draw.text(*args, font=font)
-            except UnicodeEncodeError as ee:
-                print(ee, " with ", args[1])
-                args[1] = str(node.uid)
-                draw.text(*args)
-
-    h = get_height(root) * 20
-    w = 1200
-    depth = get_depth(root)
-
-    scaling = float(w - 150) / depth  # so it fits in width
-
-    img: Image.Image = Image.new("RGB", (w, h), WHITE)
+            yield "label", (x + 5, y - 7), node.uid
+
+
+@lru_cache(maxsize=None)
+def load_font(name: str = "Arial", size: int = 12) -> ImageFont.ImageFont:
+    """ Loaded once per (name, size), PIL's default font if name is not found """
+    for candidate in (name, "DejaVuSans.ttf"):
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            pass
+    log.warning("Font %s not found, using the default one", name)
+    return ImageFont.load_default()
+
+
+def draw_dendrogram(root: Union[BiNode, LinkageMatrix], labels=List[str]):
+    font = load_font()
+    shapes = dendrogram_shapes(_as_tree(root))
+
+    _, size, _ = next(shapes)
+    img: Image.Image = Image.new("RGB", size, WHITE)
     draw = ImageDraw.Draw(img)
 
-    draw.line((0, h / 2, 10, h / 2), fill=RED)
+    for kind, coords, uid in shapes:
+        if kind == "line":
+            draw.line(coords, fill=RED)
+            continue
 
-    draw_node(root, 10, h / 2, scaling, labels, draw)
+        args = [coords, labels[uid], BLACK]
+        try:
+            draw.text(*args, font=font)
+        except UnicodeEncodeError as ee:
+            print(ee, " with ", args[1])
+            args[1] = str(uid)
+            draw.text(*args)
 
     return img
+
+
+def write_dendrogram_svg(
+    root: Union[BiNode, LinkageMatrix], labels: List[str], path: Path
+):
+    """ Same picture as draw_dendrogram, streamed to an svg file
+
+        Nothing is kept in memory but the layout, whatever the size of the tree
+    """
+    shapes = dendrogram_shapes(_as_tree(root))
+    _, (w, h), _ = next(shapes)
+    with open(path, "wt", encoding="utf-8") as fh:
+        fh.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            f'width="{w}" height="{h}" viewBox="0 0 {w} {h}">\n'
+            f'<rect width="{w}" height="{h}" fill="white"/>\n'
+            '<g stroke="red" font-family="Arial, sans-serif" font-size="12">\n'
+        )
+        for kind, coords, uid in shapes:
+            if kind == "line":
+                x1, y1, x2, y2 = coords
+                fh.write(
+                    f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}"/>\n'
+                )
+            else:
+                x, y = coords
+                fh.write(
+                    f'<text x="{x:.1f}" y="{y + 12:.1f}" stroke="none">'
+                    f"{escape(labels[uid])}</text>\n"
+                )
+        fh.write("</g>\n</svg>\n")
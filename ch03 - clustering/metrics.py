@@ -1,3 +1,5 @@
+from typing import Optional, Tuple
+
 import numpy as np
 
 
@@ -31,3 +33,93 @@ def pearson_distance(p1: np.array, p2: np.array) -> float:
     # match = distance = 0
     distance = 1.0 - similar
     return distance
+
+
+# memory allowed for the temporary arrays of one block of pairwise_* (bytes)
+MAX_MEMORY = 64 * 2 ** 20
+
+
+def _block_rows(n_cols: int, max_memory: int, arrays: int = 4) -> int:
+    """ rows per block so that `arrays` float64 (rows x n_cols) temporaries fit """
+    return max(1, max_memory // (8 * arrays * max(n_cols, 1)))
+
+
+def standardise(X: np.array) -> Tuple[np.array, np.array]:
+    """ mean-centred rows scaled to unit norm, and the mask of non-constant rows """
+    centred = X - X.mean(axis=1, keepdims=True)
+    norms = np.sqrt((centred * centred).sum(axis=1))
+    varying = norms > 0
+    centred[varying] /= norms[varying, np.newaxis]
+    centred[~varying] = 0
+    return centred, varying
+
+
+def pairwise_pearson(
+    X: np.array,
+    Y: Optional[np.array] = None,
+    *,
+    max_memory: int = MAX_MEMORY,
+    dtype=np.float64,
+) -> np.array:
+    """ pearson_distance between every row of X and every row of Y (X by default)
+
+        Rows are standardised once, then each block of rows is one matrix product
+    """
+    X = np.asarray(X, dtype=np.float64)
+    zx, varying_x = standardise(X)
+    if Y is None:
+        zy, varying_y = zx, varying_x
+    else:
+        zy, varying_y = standardise(np.asarray(Y, dtype=np.float64))
+
+    result = np.empty((zx.shape[0], zy.shape[0]), dtype=dtype)
+    step = _block_rows(zy.shape[0], max_memory, arrays=2)
+    for start in range(0, zx.shape[0], step):
+        stop = start + step
+        distance = 1.0 - zx[start:stop] @ zy.T
+        # as pearson_distance: 0 when either row is constant
+        distance[~(varying_x[start:stop, np.newaxis] & varying_y)] = 0
+        result[start:stop] = distance
+    return result
+
+
+def pairwise_euclidean(
+    X: np.array,
+    Y: Optional[np.array] = None,
+    *,
+    normalize=False,
+    max_memory: int = MAX_MEMORY,
+    dtype=np.float64,
+) -> np.array:
+    """ eucledian_distance between every row of X and every row of Y (X by default)
+
+        Squared distances come from |x|² + |y|² - 2 x.y, one matrix product per
+        block. That expansion loses precision for close rows, which are computed
+        again from their difference, also in blocks of max_memory
+    """
+    X = np.asarray(X, dtype=np.float64)
+    Y = X if Y is None else np.asarray(Y, dtype=np.float64)
+    sx = (X * X).sum(axis=1)
+    sy = (Y * Y).sum(axis=1)
+
+    result = np.empty((X.shape[0], Y.shape[0]), dtype=dtype)
+    step = _block_rows(Y.shape[0], max_memory, arrays=3)
+    for start in range(0, X.shape[0], step):
+        stop = start + step
+        scale = sx[start:stop, np.newaxis] + sy
+        squared = scale - 2.0 * (X[start:stop] @ Y.T)
+
+        close_i, close_j = np.nonzero(squared <= 1e-6 * scale)
+        # the differences of the close pairs fit in max_memory too
+        pairs = _block_rows(X.shape[1], max_memory, arrays=1)
+        for first in range(0, close_i.size, pairs):
+            i = close_i[first : first + pairs]
+            j = close_j[first : first + pairs]
+            diff = X[start + i] - Y[j]
+            squared[i, j] = np.einsum("ij,ij->i", diff, diff)
+
+        distance = np.sqrt(squared)
+        if normalize:
+            distance = 1.0 / (1.0 + distance)
+        result[start:stop] = distance
+    return result
@@ -0,0 +1,166 @@
+""" Condensed distance matrix computed in tiles on a process pool
+
+    The table lives in a multiprocessing.shared_memory block and the condensed
+    output in a memory-mapped temporary file: every worker attaches to them once,
+    computes (rows x rows) tiles of the upper triangle and writes them straight
+    into the output, so nothing but the tile coordinates goes through the pool
+    queues. The output map is returned as is, without a copy.
+
+        dist = parallel_condensed_distances(table.T, workers=8, progress=report)
+"""
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from hcluster_algorithms import PAIRWISE, condensed_index
+from metrics import pearson_distance
+
+log = logging.getLogger(__name__)
+
+# (done, total) tiles
+Progress = Callable[[int, int], None]
+
+
+def _open_block(name: str) -> SharedMemory:
+    # pylint: disable=unexpected-keyword-arg
+    try:
+        # the owner, not the attaching process, unlinks the block (python >= 3.13)
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        return SharedMemory(name=name)
+
+
+# state of every worker process
+_worker: Dict = {}
+
+
+def _init_worker(table_spec: Tuple, out_spec: Tuple, distance_fun):
+    name, dtype, shape = table_spec
+    block = _open_block(name)
+    table = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    path, dtype, shape = out_spec
+    out = np.memmap(path, np.dtype(dtype), mode="r+", shape=shape)
+    _worker.update(block=block, table=table, out=out, fun=distance_fun)
+
+
+def _fill_tile(rows: Tuple[int, int], cols: Tuple[int, int]) -> int:
+    """ Writes the pairs (i, j), i < j, of rows x cols into the output """
+    table, out, distance_fun = _worker["table"], _worker["out"], _worker["fun"]
+    n = len(table)
+    (r0, r1), (c0, c1) = rows, cols
+
+    pairwise = PAIRWISE.get(distance_fun)
+    if pairwise is not None:
+        tile = pairwise(table[r0:r1], table[c0:c1])
+    else:
+        tile = np.array(
+            [
+                [distance_fun(table[i], table[j]) for j in range(c0, c1)]
+                for i in range(r0, r1)
+            ]
+        )
+
+    for i in range(r0, min(r1, c1 - 1)):
+        start = max(c0, i + 1)
+        pos = condensed_index(n, i, start)
+        out[pos : pos + c1 - start] = tile[i - r0, start - c0 :]
+    return (r1 - r0) * (c1 - c0)
+
+
+def tiles(n: int, tile_size: int) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """ (rows, cols) ranges covering the upper triangle of an (n x n) matrix """
+    bounds = [(start, min(start + tile_size, n)) for start in range(0, n, tile_size)]
+    return [
+        (rows, cols) for a, rows in enumerate(bounds) for cols in bounds[a:] if n > 1
+    ]
+
+
+def parallel_condensed_distances(
+    table: np.array,
+    distance_fun=pearson_distance,
+    *,
+    workers: Optional[int] = None,
+    tile_size: int = 512,
+    dtype=np.float64,
+    progress: Optional[Progress] = None,
+    directory: Optional[Path] = None,
+) -> np.array:
+    """ Same result as hcluster_algorithms.condensed_distances
+
+        Tiles are tile_size x tile_size; progress(done, total) is called in this
+        process every time one of them is written.
+
+        The result is an np.memmap of a temporary file in directory (the system
+        temporary directory by default). The file is unlinked before returning,
+        its pages stay mapped until the array is released (POSIX).
+
+        The workers are spawned, so distance_fun must be picklable and importable
+        by them: a function defined at module level, not a lambda or a closure
+    """
+    try:
+        pickle.dumps(distance_fun)
+    except (pickle.PicklingError, AttributeError, TypeError) as error:
+        raise TypeError(
+            f"distance_fun {distance_fun!r} cannot be sent to the worker processes, "
+            "use a function defined at module level"
+        ) from error
+
+    table = np.ascontiguousarray(table, dtype=np.float64)
+    n = len(table)
+    size = n * (n - 1) // 2
+    dtype = np.dtype(dtype)
+    if size == 0:
+        return np.zeros(0, dtype)
+
+    table_block = SharedMemory(create=True, size=max(table.nbytes, 1))
+    out_dir = tempfile.mkdtemp(prefix="distances-", dir=directory)
+    out_path = os.path.join(out_dir, "condensed.bin")
+    try:
+        np.ndarray(table.shape, table.dtype, buffer=table_block.buf)[:] = table
+        out = np.memmap(out_path, dtype, mode="w+", shape=(size,))
+
+        work = tiles(n, tile_size)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                (table_block.name, table.dtype.str, table.shape),
+                (out_path, dtype.str, (size,)),
+                distance_fun,
+            ),
+        ) as pool:
+            futures = [pool.submit(_fill_tile, rows, cols) for rows, cols in work]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress is not None:
+                    progress(done, len(work))
+
+        return out
+    finally:
+        table_block.close()
+        table_block.unlink()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def log_progress(every: float = 0.1) -> Progress:
+    """ progress callback logging every `every` fraction of the tiles """
+    state = {"next": every}
+
+    def report(done: int, total: int):
+        if done / total >= state["next"] or done == total:
+            log.info(
+                "distances: %d/%d tiles (%3.0f %%)", done, total, 100 * done / total
+            )
+            state["next"] = done / total + every
+
+    return report
@@ -0,0 +1,111 @@
+# pylint:disable=unused-variable
+# pylint:disable=unused-argument
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+from approximate_clustering import (
+    _compose,
+    approximate_hcluster,
+    cophenetic,
+    minibatch_kmeans,
+)
+from hcluster_algorithms import LinkageMatrix, hcluster_linkage
+
+
+@pytest.fixture()
+def blobs():
+    rng = np.random.default_rng(0)
+    centres = rng.random((5, 10)) * 10
+    return np.vstack([centre + rng.normal(0, 0.3, (40, 10)) for centre in centres])
+
+
+def check_linkage(Z: np.array, n: int):
+    used = Z[:, :2].astype(int).ravel()
+    assert sorted(used) == list(range(2 * n - 2))
+    for k, (left, right, _, size) in enumerate(Z.tolist()):
+        assert left < n + k and right < n + k
+    assert Z[-1, 3] == n
+
+
+def test_cophenetic():
+    table = np.random.default_rng(1).random((12, 4))
+    result = hcluster_linkage(table, linkage="average")
+    tree = result.to_tree()
+
+    def leaves(node):
+        return [node.uid] if node.is_leaf() else leaves(node.left) + leaves(node.right)
+
+    expected = np.zeros((12, 12))
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if not node.is_leaf():
+            for i in leaves(node.left):
+                for j in leaves(node.right):
+                    expected[i, j] = expected[j, i] = node.distance
+            stack.extend([node.left, node.right])
+
+    np.testing.assert_array_equal(
+        cophenetic(result.Z, np.arange(12)), expected[np.triu_indices(12, 1)]
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_minibatch_kmeans(blobs, seed):
+    centres, labels = minibatch_kmeans(blobs, 5, batch_size=50, seed=seed)
+
+    assert centres.shape == (5, blobs.shape[1])
+    # every blob ends up in a single group
+    for start in range(0, len(blobs), 40):
+        assert len(set(labels[start : start + 40].tolist())) == 1
+
+
+@pytest.mark.parametrize("linkage", ["centroid", "average"])
+def test_approximate_hcluster(blobs, linkage):
+    result, report = approximate_hcluster(blobs, linkage=linkage, sample=50, seed=0)
+
+    check_linkage(result.Z, len(blobs))
+    assert result.centroids.shape == (2 * len(blobs) - 1, blobs.shape[1])
+    assert report["sample"] == 50
+    assert report["cophenetic_correlation"] > 0.5
+    if linkage == "average":
+        # monotone trees: the distance only drops at an inversion, where the top
+        # joins the group completed by the previous merge
+        n = len(blobs)
+        for k in np.flatnonzero(np.diff(result.Z[:, 2]) < 0) + 1:
+            assert n + k - 1 in result.Z[k, :2]
+
+
+def test_approximate_single_group(blobs):
+    result, report = approximate_hcluster(blobs, n_clusters=1, sample=30, seed=0)
+
+    np.testing.assert_allclose(result.Z, hcluster_linkage(blobs).Z)
+
+
+def test_approximate_empty():
+    with pytest.raises(ValueError):
+        approximate_hcluster(np.zeros((0, 3)))
+
+
+def test_compose_order():
+    def part(*merges):
+        return LinkageMatrix(np.array(merges, dtype=float), None)
+
+    table = np.arange(10.0).reshape(5, 2)
+    groups = [np.array([0, 2, 4]), np.array([1, 3])]
+    parts = [part([0, 1, 1.0, 2], [2, 3, 4.0, 3]), part([0, 1, 2.0, 2])]
+
+    result = _compose(table, groups, parts, part([0, 1, 5.0, 5]))
+
+    np.testing.assert_array_equal(
+        result.Z, [[0, 2, 1.0, 2], [1, 3, 2.0, 2], [4, 5, 4.0, 3], [7, 6, 5.0, 5]],
+    )
+    np.testing.assert_array_equal(result.centroids[5], [2, 3])
+
+    # the top joins the groups below the root of the first one: an inversion
+    result = _compose(table, groups, parts, part([0, 1, 3.0, 5]))
+
+    np.testing.assert_array_equal(result.Z[:, 2], [1.0, 2.0, 4.0, 3.0])
+    check_linkage(result.Z, len(table))
@@ -0,0 +1,29 @@
+import json
+
+from benchmark_clustering import cli, compare, synthetic_counts
+
+
+def test_synthetic_counts():
+    table = synthetic_counts(200, 50)
+
+    assert table.shape == (200, 50)
+    presence = (table > 0).mean(axis=0)
+    assert presence.min() > 0.02 and presence.max() < 0.6
+    assert (table == table.round()).all()
+
+
+def test_benchmark_json(tmp_path):
+    output = tmp_path / "results.json"
+
+    results = cli(
+        ["--sizes", "20", "40", "--exact-limit", "30", "--output", str(output)]
+    )
+
+    with open(output) as fh:
+        assert json.load(fh) == results
+    exact, approximate = results["runs"]
+    assert exact["exact"] and not approximate["exact"]
+    assert set(exact["seconds"]) == {"distances", "clustering", "rendering"}
+    assert set(approximate["peak_bytes"]) == {"clustering", "rendering"}
+    assert all(peak > 0 for peak in exact["peak_bytes"].values())
+    assert len(compare(results, results)) == 1 + 3 + 2
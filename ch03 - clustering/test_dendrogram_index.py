@@ -0,0 +1,94 @@
+# pylint:disable=unused-variable
+# pylint:disable=unused-argument
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+from dendrogram_index import DendrogramIndex
+from hcluster_algorithms import hcluster, hcluster_linkage
+
+
+@pytest.fixture()
+def result():
+    table = np.random.default_rng(0).random((30, 5))
+    return table, hcluster_linkage(table, linkage="average")
+
+
+def brute_force_cut(Z: np.array, threshold: float) -> np.array:
+    """ cluster of every leaf, merging only while the distance is <= threshold """
+    n = len(Z) + 1
+    members = {i: [i] for i in range(n)}
+    labels = np.arange(n)
+    for k, (left, right, distance, _) in enumerate(Z.tolist()):
+        members[n + k] = members.pop(int(left)) + members.pop(int(right))
+        if distance <= threshold:
+            labels[members[n + k]] = labels[members[n + k][0]]
+    return labels
+
+
+def same_partition(a: np.array, b: np.array) -> bool:
+    pairs = set(zip(a.tolist(), b.tolist()))
+    return len(pairs) == len(set(a.tolist())) == len(set(b.tolist()))
+
+
+def test_leaf_order(result):
+    table, linkage = result
+    index = DendrogramIndex(linkage)
+
+    assert sorted(index.order.tolist()) == list(range(len(table)))
+    root = 2 * len(table) - 2
+    assert (index.start[root], index.end[root]) == (0, len(table))
+    for k, (left, right, _, size) in enumerate(linkage.Z.tolist()):
+        node = len(table) + k
+        assert index.end[node] - index.start[node] == size
+        assert index.start[int(left)] == index.start[node]
+        assert index.end[int(right)] == index.end[node]
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.1, 0.3, 0.5, 10.0])
+def test_cut_threshold(result, threshold):
+    table, linkage = result
+    index = DendrogramIndex(linkage)
+
+    clusters = index.cut(threshold)
+
+    assert same_partition(clusters.labels, brute_force_cut(linkage.Z, threshold))
+    assert index.cut(threshold) is clusters
+
+
+@pytest.mark.parametrize("k", [1, 2, 5, 30])
+def test_cut_k(result, k):
+    table, linkage = result
+    index = DendrogramIndex(linkage)
+
+    clusters = index.cut(k=k)
+
+    assert len(clusters) == k
+    # average linkage is monotonic: same as cutting between two merges
+    distances = np.sort(linkage.Z[:, 2])
+    if k > 1:
+        threshold = distances[len(table) - k - 1] if k < len(table) else -1
+        assert same_partition(clusters.labels, brute_force_cut(linkage.Z, threshold))
+
+
+def test_cluster_of(result):
+    table, linkage = result
+    labels = [f"blog {i}" for i in range(len(table))]
+    index = DendrogramIndex(linkage, labels=labels)
+
+    clusters = index.cut(k=4)
+
+    for leaf in range(len(table)):
+        cluster = clusters.cluster_of(labels[leaf])
+        assert cluster == clusters.labels[leaf]
+        assert leaf in clusters.members(cluster)
+    with pytest.raises(ValueError):
+        index.cut()
+
+
+def test_from_tree(result):
+    table, linkage = result
+    index = DendrogramIndex.from_tree(hcluster(table, linkage="average"))
+
+    np.testing.assert_array_equal(index.Z, linkage.Z)
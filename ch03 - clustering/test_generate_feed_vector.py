@@ -0,0 +1,329 @@
+# pylint:disable=unused-variable
+# pylint:disable=unused-argument
+# pylint:disable=redefined-outer-name
+
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import pytest
+import generate_feed_vector
+from feed_fetcher import FeedCache, fetch_feeds
+from wordcount_store import WordCountStore
+
+RSS = """<?xml version="1.0"?>
+<rss version="2.0"><channel>
+<title>Blog {name}</title>
+<item><title>China kids</title><description>&lt;b&gt;music&lt;/b&gt; china</description></item>
+<item><title>Yahoo</title><description>music</description></item>
+{extra}</channel></rss>
+"""
+
+
+class StubFeeds(BaseHTTPRequestHandler):
+    """ /<name>?delay=<seconds> serves the feed of blog <name> with an ETag """
+
+    # state of one server, see the fixture
+    extra: str  # more items in every feed
+    requests: Counter  # (path, status)
+    active: int
+    max_active: int
+    lock: threading.Lock
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        stats = type(self)
+        path, _, query = self.path.partition("?")
+        with self.lock:
+            stats.active += 1
+            stats.max_active = max(stats.max_active, stats.active)
+        try:
+            if query.startswith("delay="):
+                time.sleep(float(query[len("delay=") :]))
+
+            etag = f'"{path}-{len(self.extra)}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.requests[path, 304] += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            self.requests[path, 200] += 1
+            body = RSS.format(name=path.strip("/"), extra=self.extra).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.lock:
+                stats.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def stub():
+    # requests still sleeping from a previous test must not be counted
+    handler = type(
+        "Handler",
+        (StubFeeds,),
+        {
+            "extra": "",
+            "requests": Counter(),
+            "active": 0,
+            "max_active": 0,
+            "lock": threading.Lock(),
+        },
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    handler.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield handler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_validators(stub, tmp_path):
+    urls = [f"{stub.url}/a", f"{stub.url}/b"]
+    cache = FeedCache(tmp_path / "cache.json")
+
+    results = fetch_feeds(urls, cache=cache)
+    assert [results[url].status for url in urls] == [200, 200]
+    for result in results.values():
+        cache.update(result)
+    cache.save()
+
+    cache = FeedCache(tmp_path / "cache.json")
+    results = fetch_feeds(urls, cache=cache)
+    assert all(result.not_modified for result in results.values())
+    assert urls[0] in cache
+    assert stub.requests == {
+        ("/a", 200): 1,
+        ("/b", 200): 1,
+        ("/a", 304): 1,
+        ("/b", 304): 1,
+    }
+
+
+def test_fetch_timeout(stub):
+    slow, fast = f"{stub.url}/slow?delay=2", f"{stub.url}/fast"
+
+    start = time.perf_counter()
+    results = fetch_feeds([slow, fast], timeout=0.5)
+
+    assert time.perf_counter() - start < 1.5
+    assert results[slow].error and results[slow].status is None
+    assert results[fast].status == 200
+
+
+def test_fetch_per_host(stub):
+    urls = [f"{stub.url}/{i}?delay=0.2" for i in range(6)]
+
+    results = fetch_feeds(urls, workers=6, per_host=2)
+
+    assert all(result.status == 200 for result in results.values())
+    assert stub.max_active == 2
+
+
+def test_generate_cached(stub, tmp_path, monkeypatch):
+    urls = [f"{stub.url}/a", f"{stub.url}/b", f"{stub.url}/missing?delay=2"]
+    monkeypatch.setattr(generate_feed_vector, "get_feeds", lambda: urls)
+    monkeypatch.setattr(
+        generate_feed_vector, "feed_cache_path", tmp_path / "cache.json"
+    )
+    monkeypatch.setattr(generate_feed_vector, "store_path", tmp_path / "wc.sqlite")
+
+    feeds, wc_per_blog, apcount = generate_feed_vector.generate(
+        timeout=0.5, incremental=True
+    )
+    assert feeds == {"Blog a": urls[0], "Blog b": urls[1]}
+    assert wc_per_blog["Blog a"] == {"china": 2, "kids": 1, "music": 2, "yahoo": 1}
+    assert apcount["music"] == 2
+
+    # nothing changed: nothing is parsed again
+    monkeypatch.setattr(generate_feed_vector.feedparser, "parse", None)
+    assert generate_feed_vector.generate(timeout=0.5, incremental=True) == (
+        feeds,
+        wc_per_blog,
+        apcount,
+    )
+    assert stub.requests["/a", 304] == 1
+
+
+def test_generate_incremental(stub, tmp_path, monkeypatch):
+    urls = [f"{stub.url}/a", f"{stub.url}/b"]
+    monkeypatch.setattr(generate_feed_vector, "get_feeds", lambda: urls)
+    monkeypatch.setattr(
+        generate_feed_vector, "feed_cache_path", tmp_path / "cache.json"
+    )
+    monkeypatch.setattr(generate_feed_vector, "store_path", tmp_path / "wc.sqlite")
+    generate_feed_vector.generate(incremental=True)
+
+    tokenised = []
+    entry_text = generate_feed_vector.entry_text
+    monkeypatch.setattr(
+        generate_feed_vector,
+        "entry_text",
+        lambda entry: tokenised.append(entry.title) or entry_text(entry),
+    )
+    stub.extra = (
+        "<item><guid>new</guid><title>Kids</title>"
+        "<description>opera</description></item>"
+    )
+
+    feeds, wc_per_blog, apcount = generate_feed_vector.generate(incremental=True)
+
+    assert tokenised == ["Kids", "Kids"]
+    assert wc_per_blog["Blog a"] == {
+        "china": 2,
+        "kids": 2,
+        "music": 2,
+        "yahoo": 1,
+        "opera": 1,
+    }
+    assert apcount == {"china": 2, "kids": 2, "music": 2, "yahoo": 2, "opera": 2}
+
+    # a feed left out of the list no longer counts
+    monkeypatch.setattr(generate_feed_vector, "get_feeds", lambda: urls[:1])
+    feeds, wc_per_blog, apcount = generate_feed_vector.generate(incremental=True)
+    assert list(feeds) == ["Blog a"]
+    assert apcount["opera"] == 1
+
+    # entries no longer in a feed are dropped: same counts as a fresh rebuild
+    stub.extra = ""
+    assert generate_feed_vector.generate(
+        incremental=True
+    ) == generate_feed_vector.generate(incremental=False)
+    assert "opera" not in generate_feed_vector.generate(incremental=True)[2]
+
+
+def test_generate_failed_feed(stub, tmp_path, monkeypatch, caplog):
+    urls = [f"{stub.url}/a", f"{stub.url}/b?delay=2"]
+    monkeypatch.setattr(generate_feed_vector, "get_feeds", lambda: urls)
+    monkeypatch.setattr(
+        generate_feed_vector, "feed_cache_path", tmp_path / "cache.json"
+    )
+    monkeypatch.setattr(generate_feed_vector, "store_path", tmp_path / "wc.sqlite")
+    feeds, _, _ = generate_feed_vector.generate(incremental=True)
+
+    # b times out: its counts of the previous run are kept, with a warning
+    feeds, _, _ = generate_feed_vector.generate(incremental=True, timeout=0.5)
+
+    assert list(feeds) == ["Blog a", "Blog b"]
+    assert f"{urls[1]} failed" in caplog.text
+    assert f"{urls[0]} failed" not in caplog.text
+
+
+def test_wordcount_store(tmp_path):
+    with WordCountStore(tmp_path / "wc.sqlite") as store:
+        assert store.add_entries("a", "A", [("1", Counter(x=1, y=2))]) == 1
+        assert (
+            store.add_entries("a", "A", [("1", Counter(x=1)), ("2", Counter(x=3))]) == 1
+        )
+        assert store.add_entries("b", "B", [("1", Counter(y=1))]) == 1
+
+    with WordCountStore(tmp_path / "wc.sqlite") as store:
+        assert store.feeds() == {"a": "A", "b": "B"}
+        assert store.known_entries("a") == {"1", "2"}
+        assert store.word_counts("a") == {"x": 4, "y": 2}
+        assert store.apcount() == {"x": 1, "y": 2}
+        assert store.apcount(exclude=["a"]) == {"y": 1}
+
+        assert store.remove_entries("a", ["2"]) == 1
+        assert store.known_entries("a") == {"1"}
+        assert store.word_counts("a") == {"x": 1, "y": 2}
+        assert store.remove_entries("b", ["1"]) == 1
+        assert store.word_counts("b") == {}
+        assert store.apcount() == {"x": 1, "y": 1}
+
+
+def test_matrix_roundtrip(tmp_path, monkeypatch):
+    feeds = {"A": "http://a", "B": "http://b", "C": "http://c"}
+    wc_per_blog = {
+        "A": Counter(china=2, music=1, opera=5),
+        "B": Counter(music=3),
+        "C": Counter(),
+    }
+    wordlist = ["music", "china", "kids"]
+    apcount = Counter(music=2, china=1, opera=1)
+
+    path = tmp_path / "blogdata.npz"
+    generate_feed_vector.save_matrix(
+        generate_feed_vector.pack_matrix(feeds, wc_per_blog, wordlist), path
+    )
+    matrix, blogs, words = generate_feed_vector.load_matrix(path)
+
+    assert blogs == ["A", "B", "C"]
+    assert words == wordlist
+    np.testing.assert_array_equal(matrix, [[1, 2, 0], [3, 0, 0], [0, 0, 0]])
+
+    # same matrix from the json export when there is no npz
+    monkeypatch.setattr(generate_feed_vector, "filter_words", lambda *_: wordlist)
+    data = generate_feed_vector.filter_and_pack(feeds, wc_per_blog, apcount)
+    monkeypatch.setattr(generate_feed_vector, "load_data", lambda: data)
+    from_json, blogs, words = generate_feed_vector.load_matrix(tmp_path / "none.npz")
+
+    np.testing.assert_array_equal(from_json, matrix)
+    assert blogs == ["A", "B", "C"] and words == wordlist
+
+
+def test_stale_matrix(tmp_path, monkeypatch):
+    feeds = {"A": "http://a", "B": "http://b"}
+    wordlist = ["music", "china"]
+    monkeypatch.setattr(generate_feed_vector, "data_dir", tmp_path)
+    monkeypatch.setattr(generate_feed_vector, "filter_words", lambda *_: wordlist)
+
+    def export(wc_per_blog):
+        data = generate_feed_vector.filter_and_pack(feeds, wc_per_blog, Counter())
+        with open(tmp_path / "blogdata.json", "wt") as fh:
+            json.dump(data, fh)
+
+    export({"A": Counter(music=1), "B": Counter(china=2)})
+    generate_feed_vector.convert_json()
+    matrix, _, _ = generate_feed_vector.load_matrix()
+    np.testing.assert_array_equal(matrix, [[1, 0], [0, 2]])
+
+    # a newer json (e.g. dvc pull) wins over the npz
+    export({"A": Counter(music=3), "B": Counter()})
+    npz = tmp_path / "blogdata.npz"
+    os.utime(npz, (npz.stat().st_atime, npz.stat().st_mtime - 10))
+    matrix, _, _ = generate_feed_vector.load_matrix()
+    np.testing.assert_array_equal(matrix, [[3, 0], [0, 0]])
+
+
+def test_extract_words():
+    def reference(html_text):
+        txt = re.sub(r"<[^>]+>", "", html_text)
+        return [w.lower() for w in re.split(r"[^A-Z^a-z]+", txt) if w.strip()]
+
+    for text in [
+        "<p>Hello, <b>World</b>!</p> it's 2020",
+        "na<i>me</i> x^2 Kelvin Été ",
+        "",
+        "<a href='x'>",
+    ]:
+        assert generate_feed_vector.extract_words(text) == reference(text)
+
+    counter = Counter(hello=1)
+    generate_feed_vector.count_words_into(counter, "Hello <b>hello</b> world")
+    assert counter == {"hello": 3, "world": 1}
+
+
+def test_generate_processes(stub, tmp_path, monkeypatch):
+    urls = [f"{stub.url}/a", f"{stub.url}/b"]
+    monkeypatch.setattr(generate_feed_vector, "get_feeds", lambda: urls)
+
+    assert generate_feed_vector.generate(
+        incremental=False, processes=2
+    ) == generate_feed_vector.generate(incremental=False)
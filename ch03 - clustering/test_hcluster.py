@@ -5,9 +5,23 @@
 import numpy as np
 
 import pytest
-from hcluster_algorithms import BiNode, hcluster
-from hcluster_representation import print_cluster
-from metrics import pearson_distance
+from hcluster_algorithms import (
+    LINKAGES,
+    BiNode,
+    classical_mds,
+    condensed_distances,
+    distance_matrix,
+    hcluster,
+    hcluster_linkage,
+    scaledown,
+)
+from hcluster_representation import (
+    draw_dendrogram,
+    layout,
+    print_cluster,
+    write_dendrogram_svg,
+)
+from metrics import eucledian_distance, pearson_distance
 from PIL import Image, ImageDraw, ImageFont
 
 
@@ -41,6 +55,137 @@ def test_hcluster(blogs_words_subset):
     print_cluster(btree, labels=blogs, deep=0)
 
 
+@pytest.mark.parametrize("linkage", LINKAGES)
+def test_hcluster_single_row(linkage):
+    btree = hcluster([[1, 2, 3]], pearson_distance, linkage)
+
+    assert btree.is_leaf()
+    assert btree.uid == 0
+    np.testing.assert_array_equal(btree.vec, [1, 2, 3])
+    assert len(hcluster_linkage([[1, 2, 3]], linkage=linkage)) == 0
+
+
+def test_hcluster_empty():
+    assert hcluster([]) is None
+    assert hcluster_linkage([]) is None
+
+
+def leaves(node: BiNode):
+    if node.is_leaf():
+        return [node.uid]
+    return leaves(node.left) + leaves(node.right)
+
+
+def brute_force_distances(table, linkage):
+    """ Merge distances of the naive O(n^3) algorithm """
+    rows = np.array(table, dtype=float)
+    clusters = {i: [i] for i in range(len(rows))}
+    vecs = dict(enumerate(rows))
+    aggregate = {"single": min, "complete": max, "average": np.mean}
+    distances = []
+    for k in range(len(table) - 1):
+        best = None
+        for a in clusters:
+            for b in clusters:
+                if a >= b:
+                    continue
+                if linkage == "centroid":
+                    d = pearson_distance(vecs[a], vecs[b])
+                else:
+                    pairs = [
+                        pearson_distance(rows[i], rows[j])
+                        for i in clusters[a]
+                        for j in clusters[b]
+                    ]
+                    d = aggregate[linkage](pairs)
+                if best is None or d < best[0]:
+                    best = (d, a, b)
+        d, a, b = best
+        clusters[len(table) + k] = clusters.pop(a) + clusters.pop(b)
+        vecs[len(table) + k] = 0.5 * (vecs.pop(a) + vecs.pop(b))
+        distances.append(d)
+    return distances
+
+
+def merge_distances(node: BiNode):
+    if node.is_leaf():
+        return []
+    return merge_distances(node.left) + merge_distances(node.right) + [node.distance]
+
+
+@pytest.mark.parametrize("linkage", LINKAGES)
+def test_hcluster_linkages(linkage):
+    table = np.random.default_rng(0).integers(0, 10, (20, 6)).tolist()
+
+    btree = hcluster(table, pearson_distance, linkage=linkage)
+
+    assert sorted(leaves(btree)) == list(range(len(table)))
+    assert sorted(merge_distances(btree)) == pytest.approx(
+        sorted(brute_force_distances(table, linkage))
+    )
+
+
+def test_scaledown():
+    # points of a plane, whose distances can be kept exactly
+    table = np.random.default_rng(0).random((30, 2)) @ [[1.0, 2.0, 0.0], [0.5, 0, 3]]
+    real = distance_matrix(table, eucledian_distance)
+
+    for init in ("classical", "random"):
+        points = scaledown(table, eucledian_distance, init=init, seed=0)
+        assert points.shape == (len(table), 2)
+        fake = distance_matrix(points, eucledian_distance)
+        assert np.abs(fake - real).max() < 0.05 * real.max()
+
+    np.testing.assert_allclose(
+        distance_matrix(classical_mds(real), eucledian_distance), real, atol=1e-9
+    )
+
+
+@pytest.fixture()
+def deep_tree():
+    """ chain of merges, deeper than the recursion limit """
+    node = BiNode(0, [0.0])
+    for i in range(1, 2000):
+        node = BiNode(-i, [0.0], node, BiNode(i, [0.0]), 1.0)
+    return node, [f"blog <{i}>" for i in range(2000)]
+
+
+def test_layout(deep_tree):
+    root, labels = deep_tree
+
+    heights, depths = layout(root)
+
+    assert heights[id(root)] == len(labels)
+    assert depths[id(root)] == len(labels) - 1
+    assert heights[id(root.left)] == len(labels) - 1
+
+
+def test_draw_dendrogram(deep_tree, blogs_words_subset, capsys):
+    root, labels = deep_tree
+
+    img = draw_dendrogram(root, labels)
+    assert img.size == (1200, 20 * len(labels))
+
+    print_cluster(root, labels)
+    assert capsys.readouterr().out.count("+") == len(labels) - 1
+
+    blogs, words, table = blogs_words_subset
+    img = draw_dendrogram(hcluster_linkage(table), blogs)
+    assert img.size == (1200, 20 * len(blogs))
+
+
+def test_write_dendrogram_svg(deep_tree, tmp_path):
+    root, labels = deep_tree
+
+    write_dendrogram_svg(root, labels, tmp_path / "tree.svg")
+
+    svg = (tmp_path / "tree.svg").read_text()
+    assert svg.startswith("<svg") and svg.endswith("</svg>\n")
+    assert svg.count("<text") == len(labels)
+    assert svg.count("<line") == 3 * (len(labels) - 1) + 1
+    assert "blog &lt;7&gt;" in svg
+
+
 def test_pillow_font_encoding():
     # SEE https://github.com/python-pillow/Pillow/issues/2779
     text = u"RSS feed \u2013 Search Engine Watch"
@@ -48,3 +193,38 @@ def test_pillow_font_encoding():
     draw = ImageDraw.Draw(img)
     font = ImageFont.truetype("Arial")
     draw.text((0, 0), text, "white", font=font)
+
+
+def test_condensed_distances():
+    table = np.random.default_rng(0).random((50, 8))
+    expected = [
+        pearson_distance(table[i], table[j])
+        for i in range(len(table))
+        for j in range(i + 1, len(table))
+    ]
+
+    np.testing.assert_allclose(condensed_distances(table), expected, atol=1e-12)
+    np.testing.assert_allclose(
+        condensed_distances(table, workers=3, max_memory=1000), expected, atol=1e-12
+    )
+    as_float32 = condensed_distances(table, dtype=np.float32)
+    assert as_float32.dtype == np.float32
+    np.testing.assert_allclose(as_float32, expected, atol=1e-6)
+
+
+def test_hcluster_linkage(blogs_words_subset):
+    blogs, words, table = blogs_words_subset
+
+    result = hcluster_linkage(table, pearson_distance)
+
+    assert result.Z.shape == (len(table) - 1, 4)
+    assert result.centroids.shape == (2 * len(table) - 1, len(words))
+    assert result.Z[-1, 3] == len(table)
+
+    btree = result.to_tree()
+    assert btree is result.to_tree()
+    assert btree.distance == result.Z[-1, 2]
+    assert sorted(leaves(btree)) == list(range(len(table)))
+    # nodes are views on the centroids
+    assert np.shares_memory(btree.vec, result.centroids)
+    np.testing.assert_array_equal(btree.vec, 0.5 * (btree.left.vec + btree.right.vec))
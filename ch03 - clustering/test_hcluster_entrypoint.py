@@ -0,0 +1,55 @@
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+import hcluster_entrypoint
+from benchmark_clustering import synthetic_counts
+
+
+@pytest.fixture()
+def blogdata(monkeypatch):
+    table = synthetic_counts(12, 8)
+    blogs = [f"blog {i}" for i in range(len(table))]
+    words = [f"word{j}" for j in range(table.shape[1])]
+    monkeypatch.setattr(
+        hcluster_entrypoint, "load_matrix", lambda: (table, blogs, words)
+    )
+    return table, blogs, words
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        [],
+        ["--revert"],
+        ["--approximate", "3"],
+        ["--metric", "euclidean", "--linkage", "average", "--dtype", "float32"],
+    ],
+)
+def test_cli(blogdata, tmp_path, options):
+    _, blogs, words = blogdata
+    output, svg = tmp_path / "linkage.npy", tmp_path / "tree.svg"
+
+    root, labels = hcluster_entrypoint.cli(
+        options + ["--quiet", "--output", str(output), "--dendrogram", str(svg)]
+    )
+
+    assert labels == (words if "--revert" in options else blogs)
+    Z = np.load(output)
+    assert Z.shape == (len(labels) - 1, 4)
+    assert Z[-1, 3] == len(labels)
+    assert root.distance == Z[-1, 2]
+    text = svg.read_text()
+    assert text.startswith("<svg") and text.endswith("</svg>\n")
+    assert all(label in text for label in labels)
+
+
+def test_no_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        hcluster_entrypoint, "load_matrix", lambda: (np.zeros((0, 3)), [], ["a"] * 3)
+    )
+
+    with pytest.raises(ValueError):
+        hcluster_entrypoint.main(False, output=tmp_path / "linkage.npy")
+    assert not (tmp_path / "linkage.npy").exists()
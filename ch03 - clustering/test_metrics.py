@@ -2,10 +2,27 @@
 # pylint:disable=unused-argument
 # pylint:disable=redefined-outer-name
 
+import tracemalloc
 
 import numpy as np
 
-from metrics import eucledian_distance, pearson_distance
+import pytest
+from metrics import (
+    eucledian_distance,
+    pairwise_euclidean,
+    pairwise_pearson,
+    pearson_distance,
+)
+
+
+@pytest.fixture()
+def word_counts():
+    # sparse counts like blogdata, with a constant row and a duplicated one
+    rng = np.random.default_rng(0)
+    table = rng.poisson(0.5, (30, 40)) * rng.integers(1, 20, (30, 40))
+    table[3] = 0
+    table[7] = table[5]
+    return table.astype(float)
 
 
 def test_collinear():
@@ -14,3 +31,48 @@ def test_collinear():
 
     assert pearson_distance(p0, p1) == 0.0
     assert eucledian_distance(p0, p1) == np.sqrt(p1.size)
+
+
+@pytest.mark.parametrize("max_memory", [1, 10 ** 8])
+def test_pairwise_pearson(word_counts, max_memory):
+    distances = pairwise_pearson(word_counts, max_memory=max_memory)
+
+    expected = [[pearson_distance(p1, p2) for p2 in word_counts] for p1 in word_counts]
+    np.testing.assert_allclose(distances, expected, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("max_memory", [1, 10 ** 8])
+@pytest.mark.parametrize("normalize", [False, True])
+def test_pairwise_euclidean(word_counts, max_memory, normalize):
+    X, Y = word_counts[:10], word_counts[5:]
+    distances = pairwise_euclidean(X, Y, normalize=normalize, max_memory=max_memory)
+
+    expected = [
+        [eucledian_distance(p1, p2, normalize=normalize) for p2 in Y] for p1 in X
+    ]
+    np.testing.assert_allclose(distances, expected, rtol=0, atol=1e-9)
+
+
+def test_pairwise_euclidean_memory():
+    # near duplicates: every pair is computed again from its difference
+    rng = np.random.default_rng(0)
+    X = rng.random((1, 300)) + rng.normal(0, 1e-9, (400, 300))
+    max_memory = 2 ** 20
+
+    tracemalloc.start()
+    try:
+        distances = pairwise_euclidean(X, max_memory=max_memory)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < distances.nbytes + 8 * max_memory
+    expected = [[eucledian_distance(p1, p2) for p2 in X[:20]] for p1 in X[:20]]
+    np.testing.assert_allclose(distances[:20, :20], expected, rtol=1e-6, atol=0)
+
+
+def test_pairwise_dtype(word_counts):
+    distances = pairwise_pearson(word_counts, dtype=np.float32)
+
+    assert distances.dtype == np.float32
+    np.testing.assert_allclose(distances, pairwise_pearson(word_counts), atol=1e-6)
@@ -0,0 +1,62 @@
+# pylint:disable=unused-variable
+# pylint:disable=unused-argument
+# pylint:disable=redefined-outer-name
+
+import numpy as np
+
+import pytest
+from hcluster_algorithms import condensed_distances
+from metrics import eucledian_distance, pearson_distance
+from parallel_distances import parallel_condensed_distances, tiles
+
+
+def test_tiles():
+    n = 10
+    covered = np.zeros((n, n), dtype=int)
+    for (r0, r1), (c0, c1) in tiles(n, 3):
+        covered[r0:r1, c0:c1] += 1
+
+    assert (np.triu(covered, 1) == np.triu(np.ones((n, n), dtype=int), 1)).all()
+    assert tiles(1, 3) == []
+
+
+@pytest.mark.parametrize("distance_fun", [pearson_distance, eucledian_distance])
+def test_parallel_condensed_distances(distance_fun):
+    table = np.random.default_rng(0).random((40, 6))
+    calls = []
+
+    distances = parallel_condensed_distances(
+        table,
+        distance_fun,
+        workers=2,
+        tile_size=16,
+        progress=lambda done, total: calls.append((done, total)),
+    )
+
+    np.testing.assert_allclose(
+        distances, condensed_distances(table, distance_fun), atol=1e-12
+    )
+    assert calls == [(i, 6) for i in range(1, 7)]
+
+
+def test_unpicklable_distance():
+    table = np.random.default_rng(0).random((10, 3))
+
+    with pytest.raises(TypeError, match="module level"):
+        parallel_condensed_distances(table, lambda p1, p2: 0.0, workers=2)
+
+
+def test_memmap_output(tmp_path):
+    table = np.random.default_rng(0).random((20, 4))
+
+    distances = parallel_condensed_distances(
+        table, workers=2, tile_size=8, dtype=np.float32, directory=tmp_path
+    )
+
+    # no copy: the map of a file already removed
+    assert isinstance(distances, np.memmap) and distances.dtype == np.float32
+    assert list(tmp_path.iterdir()) == []
+    np.testing.assert_allclose(
+        distances, condensed_distances(table, pearson_distance), rtol=1e-5
+    )
+    assert parallel_condensed_distances(table[:1], directory=tmp_path).size == 0
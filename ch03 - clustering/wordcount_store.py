@@ -0,0 +1,161 @@
+""" Persistent word counts of the blog corpus (SQLite)
+
+    Every entry of every feed is tokenised once and its counts kept under its
+    entry id, so a rebuild only tokenises the entries it has not seen before.
+    The totals per feed and the number of feeds every word appears in (apcount)
+    are updated incrementally as entries are added and removed.
+
+    Entries a feed no longer publishes are removed (remove_entries) when it is
+    downloaded again, so the counts are those of a fresh rebuild
+"""
+import logging
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (url TEXT PRIMARY KEY, title TEXT);
+CREATE TABLE IF NOT EXISTS entry_words (
+    feed TEXT, entry_id TEXT, word TEXT, count INTEGER,
+    PRIMARY KEY (feed, entry_id, word)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    feed TEXT, entry_id TEXT, PRIMARY KEY (feed, entry_id)
+);
+CREATE TABLE IF NOT EXISTS feed_words (
+    feed TEXT, word TEXT, count INTEGER, PRIMARY KEY (feed, word)
+);
+CREATE TABLE IF NOT EXISTS apcount (word TEXT PRIMARY KEY, feeds INTEGER);
+"""
+
+
+class WordCountStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.con = sqlite3.connect(str(self.path))
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def feeds(self) -> Dict[str, str]:
+        """ url -> title """
+        return dict(self.con.execute("SELECT url, title FROM feeds"))
+
+    def known_entries(self, url: str) -> Set[str]:
+        rows = self.con.execute("SELECT entry_id FROM entries WHERE feed = ?", (url,))
+        return {entry_id for entry_id, in rows}
+
+    def add_entries(
+        self, url: str, title: str, entries: Iterable[Tuple[str, Counter]]
+    ) -> int:
+        """ Stores the counts of the entries not seen yet, returns how many """
+        known = self.known_entries(url)
+        added = 0
+        total = Counter()
+        with self.con:
+            self.con.execute(
+                "INSERT INTO feeds (url, title) VALUES (?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET title = excluded.title",
+                (url, title),
+            )
+            for entry_id, wc in entries:
+                if entry_id in known:
+                    continue
+                known.add(entry_id)
+                added += 1
+                total.update(wc)
+                self.con.execute(
+                    "INSERT INTO entries (feed, entry_id) VALUES (?, ?)",
+                    (url, entry_id),
+                )
+                self.con.executemany(
+                    "INSERT INTO entry_words (feed, entry_id, word, count) "
+                    "VALUES (?, ?, ?, ?)",
+                    ((url, entry_id, word, count) for word, count in wc.items()),
+                )
+
+            if total:
+                present = self.word_counts(url).keys()
+                self.con.executemany(
+                    "INSERT INTO apcount (word, feeds) VALUES (?, 1) "
+                    "ON CONFLICT (word) DO UPDATE SET feeds = feeds + 1",
+                    ((word,) for word in total.keys() - present),
+                )
+                self.con.executemany(
+                    "INSERT INTO feed_words (feed, word, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (feed, word) DO UPDATE "
+                    "SET count = count + excluded.count",
+                    ((url, word, count) for word, count in total.items()),
+                )
+
+        log.debug("%s: %d new entries", url, added)
+        return added
+
+    def remove_entries(self, url: str, entry_ids: Iterable[str]) -> int:
+        """ Removes the counts of the entries, returns how many """
+        entry_ids = list(entry_ids)
+        removed = Counter()
+        with self.con:
+            for entry_id in entry_ids:
+                key = (url, entry_id)
+                removed.update(
+                    dict(
+                        self.con.execute(
+                            "SELECT word, count FROM entry_words "
+                            "WHERE feed = ? AND entry_id = ?",
+                            key,
+                        )
+                    )
+                )
+                self.con.execute(
+                    "DELETE FROM entry_words WHERE feed = ? AND entry_id = ?", key
+                )
+                self.con.execute(
+                    "DELETE FROM entries WHERE feed = ? AND entry_id = ?", key
+                )
+
+            self.con.executemany(
+                "UPDATE feed_words SET count = count - ? WHERE feed = ? AND word = ?",
+                ((count, url, word) for word, count in removed.items()),
+            )
+            gone = [
+                word
+                for word, in self.con.execute(
+                    "SELECT word FROM feed_words WHERE feed = ? AND count <= 0", (url,)
+                )
+            ]
+            self.con.executemany(
+                "DELETE FROM feed_words WHERE feed = ? AND word = ?",
+                ((url, word) for word in gone),
+            )
+            self.con.executemany(
+                "UPDATE apcount SET feeds = feeds - 1 WHERE word = ?",
+                ((word,) for word in gone),
+            )
+            self.con.execute("DELETE FROM apcount WHERE feeds <= 0")
+
+        log.debug("%s: %d entries removed", url, len(entry_ids))
+        return len(entry_ids)
+
+    def word_counts(self, url: str) -> Counter:
+        rows = self.con.execute(
+            "SELECT word, count FROM feed_words WHERE feed = ?", (url,)
+        )
+        return Counter(dict(rows))
+
+    def apcount(self, *, exclude: Iterable[str] = ()) -> Counter:
+        """ number of feeds every word appears in, ignoring the feeds in exclude """
+        counts = Counter(dict(self.con.execute("SELECT word, feeds FROM apcount")))
+        for url in exclude:
+            counts.subtract(self.word_counts(url).keys())
+        return +counts
@@ -1,6 +1,7 @@
 import urllib.error
 import urllib.parse
 import urllib.request
+from collections import OrderedDict
 from urllib.parse import urljoin
 
 from BeautifulSoup import *
@@ -13,11 +14,39 @@ mynet = nn.SearchNet("nn.db")
 # Create a list of words to ignore
 ignorewords = {"the": 1, "of": 1, "to": 1, "and": 1, "a": 1, "in": 1, "is": 1, "it": 1}
 
+# Tables getentryid may read and write, with their field. Table and field
+# names can't be query parameters, so only these are ever formatted in
+entryfields = {"urllist": "url", "wordlist": "word"}
+
+# SQLite allows at most 999 parameters per statement
+maxparams = 500
+
+
+# Least recently used mapping of values to their rowid
+class IdCache:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.ids = OrderedDict()
+
+    def get(self, value):
+        entryid = self.ids.get(value)
+        if entryid is not None:
+            self.ids.move_to_end(value)
+        return entryid
+
+    def put(self, value, entryid):
+        self.ids[value] = entryid
+        self.ids.move_to_end(value)
+        if len(self.ids) > self.maxsize:
+            self.ids.popitem(last=False)
+
 
 class Crawler:
     # Initialize the crawler with the name of database
-    def __init__(self, dbname):
+    def __init__(self, dbname, cachesize=100000):
         self.con = sqlite.connect(dbname)
+        self.idcache = dict((table, IdCache(cachesize)) for table in entryfields)
+        self.warmcache()
 
     def __del__(self):
         self.con.close()
@@ -25,20 +54,86 @@ class Crawler:
     def dbcommit(self):
         self.con.commit()
 
+    # Load the most recent ids of every table into the cache
+    def warmcache(self):
+        for table, field in entryfields.items():
+            cache = self.idcache[table]
+            try:
+                rows = self.con.cursor().execute(
+                    "select rowid,%s from %s order by rowid desc limit ?"
+                    % (field, table),
+                    (cache.maxsize,),
+                ).fetchall()
+            except sqlite.OperationalError:
+                # the tables are not created yet
+                continue
+            for entryid, value in reversed(rows):
+                cache.put(value, entryid)
+
+    def checkentryfield(self, table, field):
+        if entryfields.get(table) != field:
+            raise ValueError("Unknown entry field %s.%s" % (table, field))
+
     # Auxilliary function for getting an entry id and adding
     # it if it's not present
     def getentryid(self, table, field, value, createnew=True):
-        cur = self.con.cursor().execute(
-            "select rowid from %s where %s='%s'" % (table, field, value)
-        )
-        res = cur.fetchone()
-        if res == None:
-            cur = self.con.cursor().execute(
-                "insert into %s (%s) values ('%s')" % (table, field, value)
-            )
-            return cur.lastrowid
+        self.checkentryfield(table, field)
+        cache = self.idcache[table]
+        entryid = cache.get(value)
+        if entryid is not None:
+            return entryid
+
+        res = self.con.cursor().execute(
+            "select rowid from %s where %s=?" % (table, field), (value,)
+        ).fetchone()
+        if res != None:
+            entryid = res[0]
+        elif createnew:
+            entryid = self.con.cursor().execute(
+                "insert into %s (%s) values (?)" % (table, field), (value,)
+            ).lastrowid
         else:
-            return res[0]
+            return None
+        cache.put(value, entryid)
+        return entryid
+
+    # Same as getentryid for many values at once: one select per
+    # maxparams values missing from the cache, and a single executemany
+    # for the new ones. Returns a dictionary of value to id
+    def getentryids(self, table, field, values):
+        self.checkentryfield(table, field)
+        cache = self.idcache[table]
+        ids = {}
+        missing = []
+        for value in values:
+            if value in ids:
+                continue
+            entryid = cache.get(value)
+            if entryid is None:
+                missing.append(value)
+            ids[value] = entryid
+
+        def lookup(values):
+            for start in range(0, len(values), maxparams):
+                chunk = values[start : start + maxparams]
+                cur = self.con.cursor().execute(
+                    "select rowid,%s from %s where %s in (%s)"
+                    % (field, table, field, ",".join("?" * len(chunk))),
+                    chunk,
+                )
+                for entryid, value in cur:
+                    ids[value] = entryid
+                    cache.put(value, entryid)
+
+        lookup(missing)
+        new = [value for value in missing if ids[value] is None]
+        if new:
+            self.con.cursor().executemany(
+                "insert into %s (%s) values (?)" % (table, field),
+                [(value,) for value in new],
+            )
+            lookup(new)
+        return ids
 
     # Index an individual page
     def addtoindex(self, url, soup):
@@ -54,15 +149,14 @@ class Crawler:
         urlid = self.getentryid("urllist", "url", url)
 
         # Link each word to this url
-        for i in range(len(words)):
-            word = words[i]
-            if word in ignorewords:
-                continue
-            wordid = self.getentryid("wordlist", "word", word)
-            self.con.cursor().execute(
-                "insert into wordlocation(urlid,wordid,location) values (%d,%d,%d)"
-                % (urlid, wordid, i)
-            )
+        locations = [
+            (word, i) for i, word in enumerate(words) if word not in ignorewords
+        ]
+        wordids = self.getentryids("wordlist", "word", [word for word, i in locations])
+        self.con.cursor().executemany(
+            "insert into wordlocation(urlid,wordid,location) values (?,?,?)",
+            [(urlid, wordids[word], i) for word, i in locations],
+        )
 
     # Extract the text from an HTML page (no tags)
     def gettextonly(self, soup):
@@ -94,16 +188,15 @@ class Crawler:
         if fromid == toid:
             return
         cur = self.con.cursor().execute(
-            "insert into link(fromid,toid) values (%d,%d)" % (fromid, toid)
+            "insert into link(fromid,toid) values (?,?)", (fromid, toid)
         )
         linkid = cur.lastrowid
-        for word in words:
-            if word in ignorewords:
-                continue
-            wordid = self.getentryid("wordlist", "word", word)
-            self.con.cursor().execute(
-                "insert into linkwords(linkid,wordid) values (%d,%d)" % (linkid, wordid)
-            )
+        words = [word for word in words if word not in ignorewords]
+        wordids = self.getentryids("wordlist", "word", words)
+        self.con.cursor().executemany(
+            "insert into linkwords(linkid,wordid) values (?,?)",
+            [(linkid, wordids[word]) for word in words],
+        )
 
     # Starting with a list of pages, do a breadth
     # first search to the given depth, indexing pages